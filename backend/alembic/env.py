@@ -41,6 +41,8 @@ def do_run_migrations(connection):
 
 
 async def run_migrations_online() -> None:
+    # NullPool is fine here: every migration runs on the single connection
+    # opened below, so there's no per-statement connect to pool away.
     connectable = async_engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
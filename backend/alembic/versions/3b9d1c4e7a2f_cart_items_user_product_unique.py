@@ -0,0 +1,52 @@
+"""cart_items user_id + product_id unique
+
+Revision ID: 3b9d1c4e7a2f
+Revises: e5c7f23fa0d1
+Create Date: 2026-10-14 09:12:40.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9d1c4e7a2f'
+down_revision: Union[str, Sequence[str], None] = 'e5c7f23fa0d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Merge any duplicate (user_id, product_id) rows left by the old
+    # SELECT-then-INSERT upsert into the oldest row before adding the constraint
+    op.execute(
+        """
+        UPDATE cart_items AS keep
+        SET quantity = dup.total
+        FROM (
+            SELECT MIN(id) AS id, SUM(quantity) AS total
+            FROM cart_items
+            GROUP BY user_id, product_id
+            HAVING COUNT(*) > 1
+        ) AS dup
+        WHERE keep.id = dup.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM cart_items AS c
+        USING cart_items AS keep
+        WHERE c.user_id = keep.user_id
+          AND c.product_id = keep.product_id
+          AND c.id > keep.id
+        """
+    )
+    op.create_unique_constraint('uq_cart_items_user_product', 'cart_items', ['user_id', 'product_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_cart_items_user_product', 'cart_items', type_='unique')
@@ -0,0 +1,28 @@
+"""messages conversation_id + created_at index
+
+Revision ID: 8f2a6d0b5c91
+Revises: 3b9d1c4e7a2f
+Create Date: 2026-10-14 10:02:17.304881
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2a6d0b5c91'
+down_revision: Union[str, Sequence[str], None] = '3b9d1c4e7a2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_conversation_created', 'messages', ['conversation_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_created', table_name='messages')
@@ -0,0 +1,34 @@
+"""conversation_summaries table
+
+Revision ID: c4e81f7d2a36
+Revises: 8f2a6d0b5c91
+Create Date: 2026-10-14 11:20:45.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e81f7d2a36'
+down_revision: Union[str, Sequence[str], None] = '8f2a6d0b5c91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('conversation_summaries',
+    sa.Column('conversation_id', sa.String(length=100), nullable=False),
+    sa.Column('up_to_message_id', sa.Integer(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('conversation_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('conversation_summaries')
@@ -14,3 +14,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 db_var: ContextVar[AsyncSession] = ContextVar("db")
 user_id_var: ContextVar[str] = ContextVar("user_id")
+
+# Per-turn memo of read-only tool results, keyed by (tool_name, args JSON).
+# Set to a fresh dict at the start of every chat request.
+tool_cache_var: ContextVar[dict] = ContextVar("tool_cache")
@@ -1,16 +1,23 @@
 """
 LangGraph agent — the core reasoning loop.
 """
+import asyncio
+import json
+from functools import partial
 from typing import Annotated
 
+from langchain_core.caches import InMemoryCache
 from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from typing_extensions import TypedDict
 
 from app.config import settings
-from app.agent.tools import ALL_TOOLS
+from app.agent.tools import ALL_TOOLS, get_product_details, prefetch_products
+from app.agent.context import db_var, tool_cache_var
 
 
 # ── State ─────────────────────────────────────────────────────────────────────
@@ -44,26 +51,41 @@ You can ONLY discuss products returned by search_products. Never invent or assum
 - Redirect off-topic questions politely.
 """
 
+# Built once so every request sends a byte-identical prefix. OpenAI caches
+# prompt prefixes automatically (system prompt + tool schemas come first),
+# so the prefix must never change between turns — keep dynamic content
+# (history, tool results) after it.
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
 OPENAI_MODEL = "gpt-4o-mini"
 
+# Routes requests with the same prefix to the same cache shard
+PROMPT_CACHE_KEY = "ai-shop-agent"
+
+# Exact-match response cache for the non-streaming path only — ainvoke via
+# agent_node (POST /api/chat, the eval script). astream, which
+# POST /api/chat/stream uses, bypasses it, so streamed chat never hits it.
+# The key is the full message list plus the bound tools, and temperature=0,
+# so a hit is the answer the API would have given. Data-dependent turns
+# (cart contents) are still safe: the tool results are part of the key.
+LLM_CACHE_MAXSIZE = 1024
+
 llm = ChatOpenAI(
     model=OPENAI_MODEL,
     api_key=settings.openai_api_key,
     temperature=0,
+    cache=InMemoryCache(maxsize=LLM_CACHE_MAXSIZE),
 )
 
-llm_with_tools = llm.bind_tools(ALL_TOOLS)
+llm_with_tools = llm.bind_tools(ALL_TOOLS, prompt_cache_key=PROMPT_CACHE_KEY)
 
 
 # ── Node 1: agent_node ───────────────────────────────────────────────────────
 
 async def agent_node(state: AgentState) -> dict:
-    messages = state["messages"]
-
-    if not any(isinstance(m, SystemMessage) for m in messages):
-        messages = [SystemMessage(content=SYSTEM_PROMPT)] + list(messages)
-
-    response = await llm_with_tools.ainvoke(messages)
+    # Callers seed the state with SYSTEM_MESSAGE first, so every round sends
+    # the same cached prefix without scanning or copying the history here.
+    response = await llm_with_tools.ainvoke(state["messages"])
     return {"messages": [response]}
 
 
@@ -73,21 +95,174 @@ async def agent_node(state: AgentState) -> dict:
 
 TOOL_MAP = {t.name: t for t in ALL_TOOLS}
 
+# Catalog reads with no side effects — same args, same result within a turn.
+# Cart tools are excluded: get_current_cart changes after add_to_cart.
+CACHEABLE_TOOLS = {"search_products", "get_product_details", "compare_products"}
+
+
+def _cache_key(tool_call: dict) -> tuple[str, str]:
+    return tool_call["name"], json.dumps(tool_call["args"], sort_keys=True)
+
+
+async def invoke_tool(tool_call: dict) -> str:
+    """Run a tool call, reusing this turn's earlier result for cacheable tools."""
+    tool_fn = TOOL_MAP[tool_call["name"]]
+    cache = tool_cache_var.get(None)
+    if cache is None or tool_fn.name not in CACHEABLE_TOOLS:
+        return await tool_fn.ainvoke(tool_call["args"])
+
+    key = _cache_key(tool_call)
+    if key not in cache:
+        cache[key] = await tool_fn.ainvoke(tool_call["args"])
+    return cache[key]
+
+
+async def _outcome(tool_call: dict):
+    """invoke_tool, returning the exception a failing call raises."""
+    try:
+        return await invoke_tool(tool_call)
+    except Exception as e:
+        return e
+
+
+async def _invoke_product_details(tool_calls: list[dict]) -> list:
+    """
+    Run several get_product_details calls, loading their products with one
+    IN query first.
+
+    Each call still goes through the tool — args validation, callbacks and
+    traces, the per-turn cache — so a bad call fails alone and IDs already
+    fetched this turn aren't queried again.
+    """
+    cache = tool_cache_var.get(None) or {}
+    product_ids = []
+    for tool_call in tool_calls:
+        if _cache_key(tool_call) in cache:
+            continue
+        try:
+            args = get_product_details.args_schema.model_validate(tool_call["args"])
+        except ValidationError:
+            continue  # the tool call itself reports it
+        product_ids.append(args.product_id)
+
+    if product_ids:
+        await prefetch_products(product_ids)
+    return [await _outcome(tool_call) for tool_call in tool_calls]
+
+
+def _read_units(tool_calls: list[dict]) -> list[list[int]]:
+    """
+    Group a round's catalog reads into units of tool_calls indices: one per
+    read, except that two or more get_product_details calls share one unit.
+    """
+    details = [i for i, tc in enumerate(tool_calls) if tc["name"] == "get_product_details"]
+    batched = details if len(details) > 1 else []
+    units = [
+        [i] for i, tc in enumerate(tool_calls)
+        if tc["name"] in CACHEABLE_TOOLS and i not in batched
+    ]
+    if batched:
+        units.append(batched)
+    return units
+
+
+async def _run_unit(tool_calls: list[dict]) -> list:
+    if len(tool_calls) > 1:
+        return await _invoke_product_details(tool_calls)
+    return [await _outcome(tool_calls[0])]
+
+
+# Most pooled connections one round's concurrent reads check out, on top
+# of the request's own
+MAX_READ_SESSIONS = 3
+
+
+def _read_session_factory():
+    """
+    Sessions for concurrent reads, on the request session's own engine.
+
+    None when the request session is bound to a connection rather than an
+    engine (e.g. a test's savepointed transaction) — other connections
+    couldn't see its uncommitted rows, so the reads share it, in turn.
+    """
+    bind = db_var.get().bind
+    if isinstance(bind, AsyncEngine):
+        return partial(AsyncSession, bind, expire_on_commit=False)
+    return None
+
+
+async def _in_own_session(session_factory, limit: asyncio.Semaphore, tool_calls: list[dict]) -> list:
+    """Run a unit on a short-lived session so it can overlap with other reads."""
+    async with limit, session_factory() as session:
+        db_var.set(session)  # gather runs this in its own task — local to it
+        return await _run_unit(tool_calls)
+
+
+async def invoke_tools(tool_calls: list[dict], return_exceptions: bool = False) -> list:
+    """
+    Run one round of tool calls, returning results in tool_calls order.
+
+    Catalog reads run first, concurrently, each on its own session from
+    the request session's engine (at most MAX_READ_SESSIONS at once) — an
+    AsyncSession can't be shared across concurrent awaits. Several
+    get_product_details calls are merged into one IN query. Cart tools run
+    after, one at a time and in order, on the request session (they write
+    to the same rows).
+
+    With return_exceptions=True a failing call yields its exception instead
+    of raising, like asyncio.gather.
+    """
+    results: list = [None] * len(tool_calls)
+
+    # Catalog reads
+    units = _read_units(tool_calls)
+    unit_calls = [[tool_calls[i] for i in unit] for unit in units]
+    session_factory = _read_session_factory() if len(units) > 1 else None
+    if session_factory is not None:
+        limit = asyncio.Semaphore(MAX_READ_SESSIONS)
+        outcomes = await asyncio.gather(
+            *(_in_own_session(session_factory, limit, calls) for calls in unit_calls),
+            return_exceptions=True,
+        )
+    else:
+        # A lone unit has nothing to overlap with — use the request session
+        outcomes = [await _run_unit(calls) for calls in unit_calls]
+
+    for unit, unit_outcomes in zip(units, outcomes):
+        if isinstance(unit_outcomes, Exception):  # the unit's session failed
+            unit_outcomes = [unit_outcomes] * len(unit)
+        for i, outcome in zip(unit, unit_outcomes):
+            if isinstance(outcome, Exception) and not return_exceptions:
+                raise outcome
+            results[i] = outcome
+
+    # Cart calls, in order
+    reads = {i for unit in units for i in unit}
+    for i, tool_call in enumerate(tool_calls):
+        if i in reads:
+            continue
+        try:
+            results[i] = await invoke_tool(tool_call)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results[i] = e
+    return results
+
+
 async def tool_node(state: AgentState) -> dict:
     last_message: AIMessage = state["messages"][-1]
-
-    results = []
-    for tool_call in last_message.tool_calls:
-        tool_fn = TOOL_MAP[tool_call["name"]]
-        result = await tool_fn.ainvoke(tool_call["args"])
-
-        results.append(
-            ToolMessage(
-                content=str(result),
-                tool_call_id=tool_call["id"],
-                name=tool_call["name"],
-            )
+    tool_calls = last_message.tool_calls
+    outputs = await invoke_tools(tool_calls)
+
+    results = [
+        ToolMessage(
+            content=result,
+            tool_call_id=tool_call["id"],
+            name=tool_call["name"],
         )
+        for tool_call, result in zip(tool_calls, outputs)
+    ]
 
     return {"messages": results}
 
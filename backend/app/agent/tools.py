@@ -14,10 +14,10 @@ NOT from function arguments. This keeps them invisible to GPT-4o's schema.
 """
 from langchain_core.tools import tool
 
-from sqlalchemy import delete, select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import delete, func, select
 
 from app.models import Product, CartItem
+from app.services.cart import upsert_cart_item
 from app.services.search import semantic_search
 from app.agent.context import db_var, user_id_var
 
@@ -55,7 +55,7 @@ async def search_products(
     )
     if not products:
         return "No products found matching your search."
-    return "\n\n".join(format_product(p) for p in products)
+    return "\n\n".join([format_product(p) for p in products])
 
 
 # ── Tool 2: get_product_details ──────────────────────────────────────────────
@@ -69,10 +69,26 @@ async def get_product_details(product_id: int) -> str:
     db = db_var.get()
     product = await db.get(Product, product_id)
     if not product:
-        return f"Product with ID {product_id} not found."
+        return product_not_found(product_id)
     return format_product(product)
 
 
+def product_not_found(product_id: int) -> str:
+    return f"Product with ID {product_id} not found."
+
+
+async def prefetch_products(product_ids: list[int]) -> None:
+    """
+    Load several products into the session with one IN query.
+
+    Not a tool — invoke_tools calls it before running a round's
+    get_product_details calls, whose db.get() then finds each product in
+    the session's identity map instead of querying one at a time.
+    """
+    db = db_var.get()
+    (await db.scalars(select(Product).where(Product.id.in_(product_ids)))).all()
+
+
 # ── Tool 3: add_to_cart ──────────────────────────────────────────────────────
 
 @tool
@@ -88,22 +104,9 @@ async def add_to_cart(product_id: int, quantity: int = 1) -> str:
 
     product = await db.get(Product, product_id)
     if not product:
-        return f"Product with ID {product_id} not found."
-
-    result = await db.execute(
-        select(CartItem).where(
-            CartItem.user_id == user_id,
-            CartItem.product_id == product_id,
-        )
-    )
-    cart_item = result.scalar_one_or_none()
-
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-        db.add(cart_item)
+        return product_not_found(product_id)
 
+    await upsert_cart_item(db, user_id, product_id, quantity)
     await db.commit()
     return f"Added {quantity}x {product.name} (${product.price:.2f}) to your cart."
 
@@ -166,24 +169,29 @@ async def get_current_cart() -> str:
     db = db_var.get()
     user_id = user_id_var.get()
 
+    # Only the columns we format, with subtotals and the total computed in SQL
+    subtotal = Product.price * CartItem.quantity
     result = await db.execute(
-        select(CartItem)
+        select(
+            Product.id,
+            Product.name,
+            CartItem.quantity,
+            subtotal.label("subtotal"),
+            func.sum(subtotal).over().label("total"),
+        )
+        .join(CartItem.product)
         .where(CartItem.user_id == user_id)
-        .options(selectinload(CartItem.product))
     )
-    items = result.scalars().all()
+    rows = result.all()
 
-    if not items:
+    if not rows:
         return "Your cart is empty."
 
-    lines = []
-    total = 0.0
-    for item in items:
-        subtotal = float(item.product.price) * item.quantity
-        total += subtotal
-        lines.append(f"• [ID:{item.product.id}] {item.product.name} x{item.quantity} — ${subtotal:.2f}")
-
-    lines.append(f"\nTotal: ${total:.2f}")
+    lines = [
+        f"• [ID:{row.id}] {row.name} x{row.quantity} — ${row.subtotal:.2f}"
+        for row in rows
+    ]
+    lines.append(f"\nTotal: ${rows[0].total:.2f}")
     return "\n".join(lines)
 
 
@@ -205,10 +213,7 @@ async def compare_products(product_ids: list[int]) -> str:
     if len(products) < 2:
         return "Need at least 2 valid product IDs to compare."
 
-    lines = []
-    for p in products:
-        lines.append(format_product(p))
-    return "\n\n--- vs ---\n\n".join(lines)
+    return "\n\n--- vs ---\n\n".join([format_product(p) for p in products])
 
 
 ALL_TOOLS = [
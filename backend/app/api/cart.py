@@ -1,25 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app.database import get_db
 from app.models import CartItem, Product
 from app.schemas import CartItemAdd, CartItemResponse, CartResponse
+from app.services.cart import upsert_cart_item
 
 router = APIRouter()
 
 
 @router.get("/{user_id}", response_model=CartResponse)
 async def get_cart(user_id: str, db: AsyncSession = Depends(get_db)):
+    # One joined query: the items with their products, plus the cart total
+    # as a window sum over the same rows (exact NUMERIC math, no Python loop)
     result = await db.execute(
-        select(CartItem)
+        select(CartItem, func.sum(Product.price * CartItem.quantity).over())
+        .join(CartItem.product)
+        .options(contains_eager(CartItem.product))
         .where(CartItem.user_id == user_id)
-        .options(selectinload(CartItem.product))
     )
-    items = result.scalars().all()
-    total = sum(item.product.price * item.quantity for item in items)
-    return CartResponse(items=items, total=round(total, 2))
+    rows = result.all()
+    items = [item for item, _ in rows]
+    total = rows[0][1] if rows else 0
+    return CartResponse(items=items, total=total)
 
 
 @router.post("", response_model=CartItemResponse, status_code=201)
@@ -29,31 +35,13 @@ async def add_to_cart(body: CartItemAdd, db: AsyncSession = Depends(get_db)):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Upsert: update quantity if already in cart
-    result = await db.execute(
-        select(CartItem).where(
-            CartItem.user_id == body.user_id,
-            CartItem.product_id == body.product_id,
-        )
-    )
-    cart_item = result.scalar_one_or_none()
-
-    if cart_item:
-        cart_item.quantity += body.quantity
-    else:
-        cart_item = CartItem(**body.model_dump())
-        db.add(cart_item)
-
+    cart_item = await upsert_cart_item(db, body.user_id, body.product_id, body.quantity)
     await db.commit()
-    await db.refresh(cart_item)
-
-    # Reload with product relationship for response
-    result = await db.execute(
-        select(CartItem)
-        .where(CartItem.id == cart_item.id)
-        .options(selectinload(CartItem.product))
-    )
-    return result.scalar_one()
+    # The upsert's RETURNING row comes back without its product; attach the
+    # one we already loaded so the response doesn't lazy-load it (no IO is
+    # allowed during serialization). Set as committed state, not a change.
+    set_committed_value(cart_item, "product", product)
+    return cart_item
 
 
 @router.delete("/{item_id}", status_code=204)
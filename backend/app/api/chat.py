@@ -1,17 +1,21 @@
-import json
+import asyncio
+import contextlib
 import logging
 import uuid
+from collections.abc import AsyncIterator
 
+import orjson
 from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import ToolMessage
 
 from app.database import get_db
-from app.agent.graph import agent, SYSTEM_PROMPT, TOOL_MAP, llm_with_tools
-from app.agent.context import db_var, user_id_var
-from app.services.conversation import save_message, load_messages
+from app.agent.graph import SYSTEM_MESSAGE, TOOL_MAP, invoke_tools, llm_with_tools
+from app.agent.context import db_var, tool_cache_var, user_id_var
+from app.models import Message
+from app.services.conversation import save_messages, load_messages, load_recent_messages
 from app.services.context_manager import build_context
 from app.schemas import MessageResponse
 
@@ -24,6 +28,7 @@ router = APIRouter()
 # single user turn, something is wrong — bail out gracefully.
 MAX_TOOL_ROUNDS = 5
 MAX_MESSAGE_LENGTH = 2000  # characters, reject input over this
+TOOL_ROUNDS_EXCEEDED_REPLY = "I got a bit lost processing your request. Could you try rephrasing?"
 
 
 class ChatRequest(BaseModel):
@@ -32,42 +37,147 @@ class ChatRequest(BaseModel):
     conversation_id: str | None = None
 
 
+# Status text per tool, built once. Tools without a custom label get the
+# generic fallback here instead of an f-string per call.
 FRIENDLY_NAMES = {
+    **{name: f"Running {name}..." for name in TOOL_MAP},
     "search_products": "Searching products...",
     "get_product_details": "Getting product details...",
     "add_to_cart": "Adding to cart...",
     "remove_from_cart": "Removing from cart...",
+    "clear_cart": "Clearing your cart...",
     "get_current_cart": "Checking your cart...",
     "compare_products": "Comparing products...",
 }
 
 
-def sse_event(data: dict) -> str:
-    return f"data: {json.dumps(data)}\n\n"
+def tool_message(tool_call: dict, result) -> ToolMessage:
+    """Wrap a tool result (or the exception it raised) for the next LLM round."""
+    if isinstance(result, Exception):
+        logger.error(f"Tool {tool_call['name']} failed: {result}")
+        result = f"Tool error: unable to complete {tool_call['name']}. Please try again."
+    return ToolMessage(
+        content=result,
+        tool_call_id=tool_call["id"],
+        name=tool_call["name"],
+    )
+
+
+def sse_event(data: dict) -> bytes:
+    # Called once per streamed token. orjson (C) writes compact UTF-8 bytes
+    # directly — StreamingResponse sends bytes as-is, no re-encode.
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+# token_event's fixed bytes — the same output as sse_event for a token
+# dict, without building the dict or encoding its keys for every token
+TOKEN_EVENT_PREFIX = b'data: {"type":"token","content":'
+TOKEN_EVENT_SUFFIX = b"}\n\n"
+
+
+def token_event(token: str) -> bytes:
+    return TOKEN_EVENT_PREFIX + orjson.dumps(token) + TOKEN_EVENT_SUFFIX
+
+
+# Built once: the too-long reply is the same for every rejected request,
+# and StreamingResponse copies headers into its own list (never mutates this)
+REJECT_TOO_LONG_EVENT = sse_event({
+    "type": "token",
+    "content": f"Your message is too long. Please keep it under {MAX_MESSAGE_LENGTH} characters.",
+})
+# SSE comment sent when the stream has been quiet this long (tool rounds,
+# slow first token), so proxies and the browser don't drop an idle
+# connection. The frontend only reads "data: " lines and skips it.
+KEEPALIVE_INTERVAL = 15  # seconds
+KEEPALIVE_EVENT = b": ping\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+async def with_keepalive(
+    events: AsyncIterator[bytes], interval: float = KEEPALIVE_INTERVAL
+) -> AsyncIterator[bytes]:
+    """
+    Relay events, adding KEEPALIVE_EVENT after every `interval` seconds
+    of silence.
+
+    events is driven by one task of its own — the LLM stream and DB
+    session inside it must enter and exit in the same task. When the
+    client disconnects, Starlette cancels us and we cancel that task, which
+    stops the LLM stream too.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def produce():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        finally:
+            queue.put_nowait(finished)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), interval)
+            except TimeoutError:
+                yield KEEPALIVE_EVENT
+                continue
+            if event is finished:
+                await producer  # re-raises if events failed
+                return
+            yield event
+    finally:
+        # Wait for the cancel to land, so events' own cleanup (DB session,
+        # LLM stream) runs before the response finishes and its errors
+        # surface here instead of as "Task exception was never retrieved"
+        producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+
+
+async def release_connection(db: AsyncSession) -> None:
+    """
+    End the session's transaction so its pooled connection goes back to
+    the pool while we wait on the LLM (seconds, per round). The session
+    stays usable — the next query checks a connection out again. Only
+    reads are pending here (cart tools commit their own writes), and
+    expire_on_commit=False keeps loaded objects intact.
+    """
+    await db.commit()
 
 
 @router.post("/stream")
 async def chat_stream(body: ChatRequest, db: AsyncSession = Depends(get_db)):
     # Input validation
     if len(body.message) > MAX_MESSAGE_LENGTH:
-        async def reject():
-            yield sse_event({"type": "token", "content": "Your message is too long. Please keep it under 2000 characters."})
-            yield sse_event({"type": "done", "conversation_id": body.conversation_id or ""})
-        return StreamingResponse(reject(), media_type="text/event-stream")
+        done = sse_event({"type": "done", "conversation_id": body.conversation_id or ""})
+        return StreamingResponse(
+            iter([REJECT_TOO_LONG_EVENT, done]),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
 
     db_var.set(db)
     user_id_var.set(body.user_id)
+    tool_cache_var.set({})
 
     conversation_id = body.conversation_id or str(uuid.uuid4())
-    await save_message(db, conversation_id, "user", body.message)
 
-    db_messages = await load_messages(db, conversation_id)
-    messages = await build_context(db_messages)
+    # The user message is saved with the reply at the end of the turn
+    # (one INSERT + one commit); until then it's only in memory.
+    history = await load_recent_messages(db, conversation_id)
+    user_message = Message(conversation_id=conversation_id, role="user", content=body.message)
+    messages = await build_context([*history, user_message], db)
 
     async def event_generator():
-        current_messages = list(messages)
-        if not any(isinstance(m, SystemMessage) for m in current_messages):
-            current_messages = [SystemMessage(content=SYSTEM_PROMPT)] + current_messages
+        # Stable prefix first (cached by the provider), then the history
+        current_messages = [SYSTEM_MESSAGE] + messages
 
         # LangSmith metadata — filter traces by conversation_id or user_id
         langsmith_config = {
@@ -78,16 +188,28 @@ async def chat_stream(body: ChatRequest, db: AsyncSession = Depends(get_db)):
             "tags": [f"conv:{conversation_id}"],
         }
 
-        full_response = ""
+        reply_parts: list[str] = []  # joined once at the end
         tool_rounds = 0
 
         try:
             while True:
-                response = await llm_with_tools.ainvoke(
+                # Stream every call — a plain reply goes straight to the client,
+                # no second round-trip. Chunks add up into one AIMessageChunk,
+                # which merges tool_call_chunks into complete tool_calls.
+                await release_connection(db)
+                response = None
+                async for chunk in llm_with_tools.astream(
                     current_messages, config=langsmith_config
-                )
-
-                if response.tool_calls:
+                ):
+                    response = chunk if response is None else response + chunk
+                    token = chunk.content
+                    if token:
+                        if not reply_parts:
+                            yield sse_event({"type": "status", "content": ""})
+                        reply_parts.append(token)
+                        yield token_event(token)
+
+                if response is not None and response.tool_calls:
                     tool_rounds += 1
 
                     # Guardrail: prevent infinite tool loops
@@ -95,9 +217,9 @@ async def chat_stream(body: ChatRequest, db: AsyncSession = Depends(get_db)):
                         logger.warning(
                             f"Agent exceeded {MAX_TOOL_ROUNDS} tool rounds for conversation {conversation_id}"
                         )
-                        full_response = "I got a bit lost processing your request. Could you try rephrasing?"
+                        reply_parts = [TOOL_ROUNDS_EXCEEDED_REPLY]
                         yield sse_event({"type": "status", "content": ""})
-                        yield sse_event({"type": "token", "content": full_response})
+                        yield token_event(TOOL_ROUNDS_EXCEEDED_REPLY)
                         break
 
                     # Append AIMessage ONCE before processing its tool calls
@@ -107,57 +229,44 @@ async def chat_stream(body: ChatRequest, db: AsyncSession = Depends(get_db)):
                         tool_name = tool_call["name"]
                         yield sse_event({
                             "type": "status",
-                            "content": FRIENDLY_NAMES.get(tool_name, f"Running {tool_name}..."),
+                            "content": FRIENDLY_NAMES[tool_name],
                         })
 
-                        try:
-                            tool_fn = TOOL_MAP[tool_call["name"]]
-                            result = await tool_fn.ainvoke(tool_call["args"])
-                        except Exception as e:
-                            logger.error(f"Tool {tool_name} failed: {e}")
-                            result = f"Tool error: unable to complete {tool_name}. Please try again."
+                    # Independent calls in this round run concurrently
+                    results = await invoke_tools(response.tool_calls, return_exceptions=True)
 
-                        if tool_name in ("add_to_cart", "remove_from_cart", "clear_cart"):
+                    for tool_call, result in zip(response.tool_calls, results):
+                        if tool_call["name"] in ("add_to_cart", "remove_from_cart", "clear_cart"):
                             yield sse_event({"type": "cart_updated"})
 
-                        current_messages.append(ToolMessage(
-                            content=str(result),
-                            tool_call_id=tool_call["id"],
-                            name=tool_call["name"],
-                        ))
+                        current_messages.append(tool_message(tool_call, result))
 
                     continue
 
                 else:
                     yield sse_event({"type": "status", "content": ""})
-
-                    async for chunk in llm_with_tools.astream(
-                        current_messages, config=langsmith_config
-                    ):
-                        token = chunk.content
-                        if token:
-                            full_response += token
-                            yield sse_event({"type": "token", "content": token})
-
                     break
 
         except Exception as e:
             logger.error(f"Agent error for conversation {conversation_id}: {e}")
-            full_response = "Sorry, I encountered an error. Please try again in a moment."
+            error_reply = "Sorry, I encountered an error. Please try again in a moment."
+            reply_parts = [error_reply]
             yield sse_event({"type": "status", "content": ""})
-            yield sse_event({"type": "token", "content": full_response})
-
-        await save_message(db, conversation_id, "assistant", full_response)
+            yield token_event(error_reply)
+
+        # Save before "done": the client reloads the conversation's messages
+        # on done, and a client that disconnects right after it cancels this
+        # generator — either way the turn must already be committed.
+        await save_messages(db, conversation_id, [
+            ("user", body.message),
+            ("assistant", "".join(reply_parts)),
+        ])
         yield sse_event({"type": "done", "conversation_id": conversation_id})
 
     return StreamingResponse(
-        event_generator(),
+        with_keepalive(event_generator()),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
+        headers=SSE_HEADERS,
     )
 
 
@@ -176,16 +285,43 @@ class ChatResponse(BaseModel):
     conversation_id: str
 
 
+async def run_agent(messages: list, config: dict) -> str:
+    """
+    Run the agent loop to a final reply without streaming.
+
+    Same steps as the compiled graph (agent → tools → agent …), as a plain
+    loop like chat_stream's, so there's no LangGraph scheduling per step.
+    """
+    for _ in range(MAX_TOOL_ROUNDS + 1):
+        await release_connection(db_var.get())
+        response = await llm_with_tools.ainvoke(messages, config=config)
+        if not response.tool_calls:
+            return response.content
+
+        messages.append(response)
+        results = await invoke_tools(response.tool_calls, return_exceptions=True)
+        messages.extend(
+            tool_message(tool_call, result)
+            for tool_call, result in zip(response.tool_calls, results)
+        )
+
+    logger.warning(f"Agent exceeded {MAX_TOOL_ROUNDS} tool rounds")
+    return TOOL_ROUNDS_EXCEEDED_REPLY
+
+
 @router.post("", response_model=ChatResponse)
 async def chat(body: ChatRequest, db: AsyncSession = Depends(get_db)):
     db_var.set(db)
     user_id_var.set(body.user_id)
+    tool_cache_var.set({})
 
     conversation_id = body.conversation_id or str(uuid.uuid4())
-    await save_message(db, conversation_id, "user", body.message)
 
-    db_messages = await load_messages(db, conversation_id)
-    messages = await build_context(db_messages)
+    # The user message is saved with the reply at the end of the turn
+    # (one INSERT + one commit); until then it's only in memory.
+    history = await load_recent_messages(db, conversation_id)
+    user_message = Message(conversation_id=conversation_id, role="user", content=body.message)
+    messages = await build_context([*history, user_message], db)
 
     langsmith_config = {
         "metadata": {
@@ -195,8 +331,10 @@ async def chat(body: ChatRequest, db: AsyncSession = Depends(get_db)):
         "tags": [f"conv:{conversation_id}"],
     }
 
-    result = await agent.ainvoke({"messages": messages}, config=langsmith_config)
-    ai_message = result["messages"][-1]
+    reply = await run_agent([SYSTEM_MESSAGE] + messages, config=langsmith_config)
 
-    await save_message(db, conversation_id, "assistant", ai_message.content)
-    return ChatResponse(reply=ai_message.content, conversation_id=conversation_id)
+    await save_messages(db, conversation_id, [
+        ("user", body.message),
+        ("assistant", reply),
+    ])
+    return ChatResponse(reply=reply, conversation_id=conversation_id)
@@ -1,8 +1,10 @@
-from fastapi import APIRouter
-from app.config import settings
+from fastapi import APIRouter, Response
 router = APIRouter()
 
+# Probes hit this every few seconds — send fixed bytes, no serialization
+HEALTH_BODY = b'{"status":"ok"}'
+
 
 @router.get("/health")
-def health_check():
-    return {"status": "ok1", "settings": settings}
+async def health_check():
+    return Response(content=HEALTH_BODY, media_type="application/json")
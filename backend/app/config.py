@@ -9,5 +9,14 @@ class Settings(BaseSettings):
     pinecone_api_key: str
     pinecone_index: str
 
+    # Connection pool — the default (5 + 10 overflow) runs out under
+    # concurrent chat streams, which hold a connection for the whole reply
+    db_pool_size: int = 20
+    db_max_overflow: int = 40
+    db_pool_recycle: int = 3600  # seconds; drop connections before the server/LB does
+    # Behind PgBouncer in transaction mode: let PgBouncer pool, and turn off
+    # asyncpg's prepared-statement cache (statements don't survive a server swap)
+    db_pgbouncer: bool = False
+
 
 settings = Settings()
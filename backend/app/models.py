@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, ForeignKey, Integer, Numeric, String, Text, func
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, Numeric, String, Text, UniqueConstraint, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database import Base
@@ -24,6 +24,11 @@ class Product(Base):
 
 class CartItem(Base):
     __tablename__ = "cart_items"
+    # One row per (user, product) — backs the add-to-cart upsert (ON CONFLICT)
+    # and the user_id + product_id lookups in remove_from_cart
+    __table_args__ = (
+        UniqueConstraint("user_id", "product_id", name="uq_cart_items_user_product"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -42,3 +47,20 @@ class Message(Base):
     role: Mapped[str] = mapped_column(String(20), nullable=False)  # "user" or "assistant"
     content: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    # Matches load_messages' ORDER BY, so a conversation's newest N rows are
+    # an index range scan instead of a sort over every message it has
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),
+    )
+
+
+class ConversationSummary(Base):
+    """Latest summary of a conversation's older messages (see build_context)."""
+
+    __tablename__ = "conversation_summaries"
+
+    conversation_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    up_to_message_id: Mapped[int] = mapped_column(Integer, nullable=False)  # last message summarized
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
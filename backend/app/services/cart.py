@@ -0,0 +1,35 @@
+"""
+Cart writes shared by the REST endpoint and the agent's add_to_cart tool.
+"""
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import CartItem
+
+
+async def upsert_cart_item(
+    db: AsyncSession,
+    user_id: str,
+    product_id: int,
+    quantity: int,
+) -> CartItem:
+    """
+    Add `quantity` of a product to the user's cart in a single statement.
+
+    INSERT ... ON CONFLICT (user_id, product_id) DO UPDATE adds to the
+    existing quantity, so there's no SELECT first and two concurrent adds
+    can't create duplicate rows. Does not commit.
+    """
+    stmt = insert(CartItem).values(
+        user_id=user_id,
+        product_id=product_id,
+        quantity=quantity,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CartItem.user_id, CartItem.product_id],
+        set_={"quantity": CartItem.quantity + stmt.excluded.quantity},
+    ).returning(CartItem)
+
+    # populate_existing: refresh the row if this session already holds it
+    result = await db.scalars(stmt, execution_options={"populate_existing": True})
+    return result.one()
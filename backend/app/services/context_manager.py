@@ -17,12 +17,17 @@ The solution: keep recent messages verbatim, summarize older ones.
 │  Message 20: user: "new msg"   (verbatim)        │
 └──────────────────────────────────────────────────┘
 """
+import asyncio
+from collections import OrderedDict
+
 import tiktoken
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.models import Message
+from app.models import ConversationSummary, Message
 
 # tiktoken encoder for GPT-4o — used to count tokens accurately
 # This is the same tokenizer GPT-4o uses internally
@@ -37,6 +42,21 @@ MAX_HISTORY_TOKENS = 4000
 # (even if they exceed the token budget slightly)
 MIN_RECENT_MESSAGES = 6
 
+# The split between summary and verbatim window only moves in steps of this
+# many messages. Between steps the window grows append-only, so consecutive
+# turns send a byte-identical prefix ([system][summary][msg_k..]) and hit
+# OpenAI's prompt cache. The window may run over the token budget by up to
+# WINDOW_STEP - 1 messages before it resets.
+WINDOW_STEP = 10
+
+# Summaries of the old part, keyed by (conversation_id, last summarized
+# message id). Reused until the split moves — saves a summarizer call per
+# turn and keeps the summary text stable for the prompt cache. The latest
+# one per conversation is also kept in conversation_summaries, so other
+# workers and restarts reuse it too.
+SUMMARY_CACHE_SIZE = 1024
+_summary_cache: OrderedDict[tuple[str, int], str] = OrderedDict()
+
 # LLM for summarization — use a cheaper/faster call
 summarizer = ChatOpenAI(
     model="gpt-4o-mini",
@@ -47,58 +67,141 @@ summarizer = ChatOpenAI(
 
 def count_tokens(text: str) -> int:
     """Count tokens in a string using GPT-4o's tokenizer."""
-    return len(ENCODER.encode(text))
+    return len(ENCODER.encode_ordinary(text))
+
+
+def count_tokens_batch(texts: list[str]) -> list[int]:
+    """
+    count_tokens for many strings at once.
+
+    One call into tiktoken, which encodes on its own thread pool with the
+    GIL released. encode_ordinary treats special-token text like
+    "<|endoftext|>" in user input as plain text instead of raising.
+    """
+    return [len(tokens) for tokens in ENCODER.encode_ordinary_batch(texts)]
 
 
 def messages_to_langchain(db_messages: list[Message]) -> list[HumanMessage | AIMessage]:
     """Convert DB messages to LangChain message objects."""
-    result = []
-    for msg in db_messages:
-        if msg.role == "user":
-            result.append(HumanMessage(content=msg.content))
-        else:
-            result.append(AIMessage(content=msg.content))
-    return result
+    # Regular constructors on purpose: model_construct() is slower for
+    # LangChain messages (it bypasses the compiled validator fast path)
+    return [
+        HumanMessage(content=msg.content) if msg.role == "user" else AIMessage(content=msg.content)
+        for msg in db_messages
+    ]
 
 
-async def build_context(db_messages: list[Message]) -> list:
+def recent_window_start(token_counts: list[int]) -> int:
+    """
+    Index where the verbatim window starts.
+
+    Walks back from the newest message, keeping messages while the running
+    total fits MAX_HISTORY_TOKENS. The last MIN_RECENT_MESSAGES are always
+    kept, even if they go over.
+    """
+    start = len(token_counts)
+    total = 0
+    while start > 0:
+        total += token_counts[start - 1]
+        kept = len(token_counts) - start
+        if total > MAX_HISTORY_TOKENS and kept >= MIN_RECENT_MESSAGES:
+            break
+        start -= 1
+    return start
+
+
+async def build_context(db_messages: list[Message], db: AsyncSession | None = None) -> list:
     """
     Build the conversation context for the agent.
 
     Strategy:
       1. Count total tokens in all messages
       2. If under budget → return everything verbatim
-      3. If over budget → summarize older messages, keep recent ones verbatim
+      3. If over budget → keep the newest messages that fit the budget
+         verbatim (split snapped to WINDOW_STEP), summarize everything older
+
+    With db, summaries are looked up in and saved to conversation_summaries.
 
     Returns a list of LangChain messages ready for the agent.
     """
     if not db_messages:
         return []
 
-    lc_messages = messages_to_langchain(db_messages)
-
-    # Count total tokens
-    total_tokens = sum(count_tokens(m.content) for m in lc_messages)
+    # Count tokens once per message — reused for the window split below.
+    # Off the event loop: encoding a long history is CPU-bound and would
+    # stall every other open stream meanwhile.
+    token_counts = await asyncio.to_thread(count_tokens_batch, [m.content for m in db_messages])
 
     # Under budget — return everything as-is
-    if total_tokens <= MAX_HISTORY_TOKENS:
-        return lc_messages
-
-    # Over budget — split into old (to summarize) and recent (to keep)
-    recent = lc_messages[-MIN_RECENT_MESSAGES:]
-    old = lc_messages[:-MIN_RECENT_MESSAGES]
-
-    if not old:
+    if sum(token_counts) <= MAX_HISTORY_TOKENS:
+        return messages_to_langchain(db_messages)
+
+    # Over budget — split into old (to summarize) and recent (to keep).
+    # Snap the split down to a WINDOW_STEP boundary so it stays put
+    # across turns (see WINDOW_STEP). LangChain messages are only built
+    # for the part that's sent verbatim.
+    split = recent_window_start(token_counts)
+    split -= split % WINDOW_STEP
+    recent = messages_to_langchain(db_messages[split:])
+
+    if split == 0:
         # Not enough messages to summarize, just return recent
         return recent
 
     # Summarize older messages
-    summary = await summarize_messages(old)
+    summary = await cached_summary(db_messages[:split], db)
 
     # Return: [summary] + recent messages
     return [SystemMessage(content=f"Summary of earlier conversation:\n{summary}")] + recent
 
 
+async def cached_summary(old: list[Message], db: AsyncSession | None = None) -> str:
+    """summarize_messages, reused while the split stays on the same message."""
+    last_old = old[-1]
+    if last_old.id is None:
+        return await summarize_messages(messages_to_langchain(old))
+
+    key = (last_old.conversation_id, last_old.id)
+    summary = _summary_cache.get(key)
+    if summary is not None:
+        _summary_cache.move_to_end(key)
+        return summary
+
+    stored = None
+    if db is not None:
+        stored = await db.get(ConversationSummary, last_old.conversation_id, populate_existing=True)
+    if stored is not None and stored.up_to_message_id == last_old.id:
+        summary = stored.summary
+    else:
+        summary = await summarize_messages(messages_to_langchain(old))
+        if db is not None:
+            await save_summary(db, last_old.conversation_id, last_old.id, summary)
+
+    _summary_cache[key] = summary
+    if len(_summary_cache) > SUMMARY_CACHE_SIZE:
+        _summary_cache.popitem(last=False)
+    return summary
+
+
+async def save_summary(
+    db: AsyncSession,
+    conversation_id: str,
+    up_to_message_id: int,
+    summary: str,
+) -> None:
+    """Replace the conversation's stored summary and commit."""
+    stmt = insert(ConversationSummary).values(
+        conversation_id=conversation_id,
+        up_to_message_id=up_to_message_id,
+        summary=summary,
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[ConversationSummary.conversation_id],
+        set_={"up_to_message_id": stmt.excluded.up_to_message_id, "summary": stmt.excluded.summary},
+    ))
+    await db.commit()
+
+
 async def summarize_messages(messages: list) -> str:
     """
     Compress a list of messages into a short summary.
@@ -5,10 +5,15 @@ This is the backbone of multi-turn memory. Every message (user and assistant)
 gets stored with a conversation_id so we can reconstruct the full history
 on the next request.
 """
-from sqlalchemy import select
+from sqlalchemy import func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Message
+from app.services.context_manager import WINDOW_STEP
+
+# How many recent messages the chat endpoints load as history. Older ones
+# fall out of the prompt (and the summary) entirely.
+HISTORY_LIMIT = 50
 
 
 async def save_message(
@@ -28,6 +33,30 @@ async def save_message(
     return message
 
 
+async def save_messages(
+    db: AsyncSession,
+    conversation_id: str,
+    messages: list[tuple[str, str]],
+) -> list[int]:
+    """
+    Save several (role, content) messages in one INSERT and one commit.
+
+    The chat endpoints call this once per turn with the user message and
+    the reply, instead of two save_message() round-trips and commits.
+    Returns the new message IDs in input order.
+    """
+    result = await db.execute(
+        insert(Message).returning(Message.id, sort_by_parameter_order=True),
+        [
+            {"conversation_id": conversation_id, "role": role, "content": content}
+            for role, content in messages
+        ],
+    )
+    ids = list(result.scalars())
+    await db.commit()
+    return ids
+
+
 async def load_messages(
     db: AsyncSession,
     conversation_id: str,
@@ -36,6 +65,36 @@ async def load_messages(
     result = await db.execute(
         select(Message)
         .where(Message.conversation_id == conversation_id)
-        .order_by(Message.created_at.asc())
+        # Messages saved in one transaction share created_at — id breaks the tie
+        .order_by(Message.created_at.asc(), Message.id.asc())
     )
     return result.scalars().all()
+
+
+async def load_recent_messages(
+    db: AsyncSession,
+    conversation_id: str,
+    limit: int = HISTORY_LIMIT,
+) -> list[Message]:
+    """
+    Load about the newest `limit` messages, ordered by creation time.
+
+    The first message returned sits on a WINDOW_STEP boundary counted from
+    the start of the conversation (so up to limit + WINDOW_STEP - 1 come
+    back). That keeps build_context's split, which is snapped to
+    WINDOW_STEP, in the same place from one turn to the next.
+    """
+    result = await db.execute(
+        select(Message, func.count().over())
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit + WINDOW_STEP - 1)
+    )
+    rows = result.all()
+    if not rows:
+        return []
+
+    total = rows[0][1]
+    start = max(total - limit, 0)
+    start -= start % WINDOW_STEP
+    return [message for message, _ in reversed(rows[:total - start])]
@@ -1,3 +1,7 @@
+import base64
+from array import array
+from collections import OrderedDict
+
 from openai import AsyncOpenAI
 from app.config import settings
 
@@ -6,6 +10,12 @@ client = AsyncOpenAI(api_key=settings.openai_api_key)
 EMBEDDING_MODEL = "text-embedding-3-small"
 EMBEDDING_DIMENSIONS = 1536
 
+# LRU of query embeddings. Shoppers repeat queries a lot ("rain jacket"),
+# and each miss is an OpenAI round-trip. Vectors are stored as float32
+# arrays (~6 KB each) rather than lists of Python floats (~50 KB each).
+QUERY_CACHE_SIZE = 4096
+_query_cache: OrderedDict[str, array] = OrderedDict()
+
 
 def build_product_text(product) -> str:
     """
@@ -43,3 +53,46 @@ async def embed_texts(texts: list[str]) -> list[list[float]]:
     )
     # Response comes back in the same order as input
     return [item.embedding for item in response.data]
+
+
+async def embed_vector(text: str) -> array:
+    """
+    Embed a single string as a float32 array.
+
+    Asks for base64 and decodes the raw float32 bytes straight into an
+    array, instead of letting the SDK build a list of Python floats that
+    we'd convert back.
+    """
+    response = await client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=text,
+        encoding_format="base64",
+    )
+    return array("f", base64.b64decode(response.data[0].embedding))
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold and collapse whitespace so trivially different queries share a cache entry."""
+    return " ".join(query.lower().split())
+
+
+async def embed_query(query: str) -> list[float]:
+    """Embed a search query, reusing the vector if the query was seen recently."""
+    key = normalize_query(query)
+    vector = _query_cache.get(key)
+    if vector is not None:
+        _query_cache.move_to_end(key)
+        return vector.tolist()
+
+    vector = await embed_vector(key)
+    cache_query_vector(key, vector)
+    return vector.tolist()
+
+
+def cache_query_vector(query: str, vector: array) -> None:
+    """Store a query's vector in the LRU, e.g. one loaded from elsewhere."""
+    key = normalize_query(query)
+    _query_cache[key] = vector
+    _query_cache.move_to_end(key)
+    if len(_query_cache) > QUERY_CACHE_SIZE:
+        _query_cache.popitem(last=False)  # evict least recently used
@@ -1,11 +1,27 @@
-from sqlalchemy import select
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Product
-from app.services.embeddings import embed_text
+from app.services.embeddings import embed_query
 from app.services.vector_store import search_similar
 
 
+def build_metadata_filter(max_price: float | None, category: str | None) -> dict | None:
+    """
+    Pinecone metadata filter for the price/category constraints.
+
+    Stock isn't here — it changes after seeding, so only SQL checks it.
+    SQL re-checks price and category too; Pinecone metadata is a copy.
+    """
+    conditions = {}
+    if max_price is not None:
+        conditions["price"] = {"$lte": max_price}
+    if category is not None:
+        conditions["category"] = {"$eq": category.strip().lower()}
+    return conditions or None
+
+
 async def semantic_search(
     query: str,
     db: AsyncSession,
@@ -27,12 +43,17 @@ async def semantic_search(
     so we let SQL do what SQL is good at.
     """
 
-    # Step 1: Embed the query
-    query_vector = await embed_text(query)
+    # Step 1: Embed the query (cached for repeated queries)
+    query_vector = await embed_query(query)
 
-    # Step 2: Get top-k similar product IDs from Pinecone
-    # We fetch more than needed because SQL filters may reduce the count
-    matches = search_similar(query_vector, top_k=top_k * 2)
+    # Step 2: Get top-k similar product IDs from Pinecone, with price and
+    # category filtered there so selective filters don't starve the results.
+    # We fetch more than needed because the SQL stock filter may reduce the count
+    matches = await search_similar(
+        query_vector,
+        top_k=top_k * 2,
+        filter=build_metadata_filter(max_price, category),
+    )
 
     if not matches:
         return []
@@ -40,10 +61,18 @@ async def semantic_search(
     # Extract product IDs in similarity order (best match first)
     product_ids = [int(m.id) for m in matches]
 
-    # Step 3: Fetch full records from PostgreSQL
-    stmt = select(Product).where(Product.id.in_(product_ids))
+    # Step 3: Fetch full records from PostgreSQL, kept in similarity order.
+    # IN doesn't preserve order, so sort by each ID's position in the list.
+    stmt = (
+        select(Product)
+        .where(Product.id.in_(product_ids))
+        .order_by(func.array_position(cast(product_ids, ARRAY(Integer)), Product.id))
+        .limit(top_k)
+    )
 
-    # Apply hard filters — things embeddings can't handle reliably
+    # Apply hard filters — things embeddings can't handle reliably.
+    # Price and category were filtered in Pinecone already, but its metadata
+    # is a copy made at seed time; the database is the source of truth.
     if max_price is not None:
         stmt = stmt.where(Product.price <= max_price)
     if category is not None:
@@ -52,14 +81,4 @@ async def semantic_search(
         stmt = stmt.where(Product.stock > 0)
 
     result = await db.execute(stmt)
-    products_by_id = {p.id: p for p in result.scalars().all()}
-
-    # Step 4: Re-sort by Pinecone similarity score
-    # SQL's IN clause doesn't preserve order, so we restore it manually
-    sorted_products = [
-        products_by_id[pid]
-        for pid in product_ids
-        if pid in products_by_id
-    ]
-
-    return sorted_products[:top_k]
+    return result.scalars().all()
@@ -1,3 +1,5 @@
+import asyncio
+
 from pinecone import Pinecone
 from app.config import settings
 
@@ -29,7 +31,11 @@ def upsert_products(vectors: list[tuple[str, list[float], dict]]) -> None:
     index.upsert(vectors=records)
 
 
-def search_similar(query_vector: list[float], top_k: int = 10) -> list[dict]:
+async def search_similar(
+    query_vector: list[float],
+    top_k: int = 10,
+    filter: dict | None = None,
+) -> list[dict]:
     """
     Find the top-k most similar products to the query vector.
 
@@ -38,12 +44,22 @@ def search_similar(query_vector: list[float], top_k: int = 10) -> list[dict]:
       - score:    cosine similarity (0.0 to 1.0, higher = more similar)
       - metadata: whatever we stored during upsert
 
+    `filter` is a Pinecone metadata filter (e.g. {"price": {"$lte": 50}}),
+    applied before ranking — so a selective filter still returns top_k
+    matches instead of top_k mostly-rejected ones.
+
     We fetch more than we need (top_k=10) because some will be
-    filtered out by SQL constraints (price, stock) in the next step.
+    filtered out by SQL constraints (stock) in the next step.
+
+    The client is synchronous, so the query runs in a worker thread —
+    otherwise its HTTP round-trip would block the event loop (and every
+    open chat stream) until Pinecone answers.
     """
-    result = index.query(
+    result = await asyncio.to_thread(
+        index.query,
         vector=query_vector,
         top_k=top_k,
+        filter=filter,
         include_metadata=True,
     )
     return result.matches
@@ -14,26 +14,40 @@ Usage:
     uv run python scripts/eval_agent.py              # run all evals
     uv run python scripts/eval_agent.py single       # single-turn only
     uv run python scripts/eval_agent.py multi        # multi-turn only
+    uv run python scripts/eval_agent.py single --no-cache   # re-run everything
+
+Predictions are cached on disk (scripts/.eval_llm_cache.json), keyed by
+model, system prompt, tool schemas and input (the user message, or all the
+turns for e2e) — re-runs only call the agent for examples (or prompts/tools)
+that changed. e2e runs also depend on the catalog in the DB and Pinecone;
+use --no-cache after changing it.
 """
 
 import asyncio
+import hashlib
+import json
 import os
 import re
 import sys
+import textwrap
+from itertools import islice
 
+import orjson
 from dotenv import load_dotenv
+from sqlalchemy import delete
 
 # Load .env from backend directory
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
-from langsmith import Client, evaluate
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langsmith import Client, aevaluate
 
 # Import the LLM + tools binding and system prompt from the app
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from app.agent.graph import SYSTEM_PROMPT, agent, llm_with_tools
+from app.agent.graph import SYSTEM_MESSAGE, agent, llm_with_tools
 from app.agent.context import db_var, user_id_var
 from app.database import SessionLocal
+from app.models import CartItem
 
 # ── Config ───────────────────────────────────────────────────────────────────
 
@@ -112,13 +126,51 @@ def get_or_create_dataset(client: Client, name: str, examples: list[dict], *, bu
 
 # ── Target function: single-turn ─────────────────────────────────────────────
 
-def predict(inputs: dict) -> dict:
-    """Single-turn: call the LLM with tools and return the response."""
+# Rows are independent LLM calls — aevaluate runs up to this many at once
+SINGLE_TURN_CONCURRENCY = 16
+
+EVAL_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".eval_llm_cache.json")
+USE_EVAL_CACHE = "--no-cache" not in sys.argv
+
+# Everything besides the input that shapes the response — a change to the
+# prompt, a tool docstring or the model invalidates every cached entry
+_CACHE_PREFIX = json.dumps(
+    [llm_with_tools.bound.model_name, SYSTEM_MESSAGE.content, llm_with_tools.kwargs],
+    sort_keys=True,
+)
+
+
+def load_eval_cache() -> dict:
+    if not USE_EVAL_CACHE or not os.path.exists(EVAL_CACHE_PATH):
+        return {}
+    with open(EVAL_CACHE_PATH) as f:
+        return json.load(f)
+
+
+def save_eval_cache(cache: dict) -> None:
+    if USE_EVAL_CACHE:
+        with open(EVAL_CACHE_PATH, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def eval_cache_key(user_input: str) -> str:
+    return hashlib.sha256(f"{_CACHE_PREFIX}\x00{user_input}".encode()).hexdigest()
+
+
+_eval_cache = load_eval_cache()
+
+
+# LLM calls in progress, by cache key — duplicate inputs in one run (which
+# aevaluate starts concurrently, before either is cached) share one call
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+async def _call_llm(user_input: str) -> dict:
     messages = [
-        SystemMessage(content=SYSTEM_PROMPT),
-        HumanMessage(content=inputs["input"]),
+        SYSTEM_MESSAGE,
+        HumanMessage(content=user_input),
     ]
-    response = llm_with_tools.invoke(messages)
+    response = await llm_with_tools.ainvoke(messages)
 
     tool_calls = response.tool_calls if response.tool_calls else []
     first_tool = tool_calls[0]["name"] if tool_calls else None
@@ -130,81 +182,175 @@ def predict(inputs: dict) -> dict:
     }
 
 
+async def apredict(inputs: dict) -> dict:
+    """Single-turn: call the LLM with tools and return the response."""
+    key = eval_cache_key(inputs["input"])
+    if USE_EVAL_CACHE and key in _eval_cache:
+        return _eval_cache[key]
+
+    if key not in _in_flight:
+        _in_flight[key] = asyncio.ensure_future(_call_llm(inputs["input"]))
+    outputs = await _in_flight[key]
+    _eval_cache[key] = outputs
+    return outputs
+
+
 # ── Target function: e2e multi-turn (real agent graph) ──────────────────────
 
+def _dump_args(args: dict) -> str:
+    # Sorted keys keep the line identical across runs, whatever order the
+    # model emitted the arguments in
+    return orjson.dumps(args, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def _ai_entries(msg: AIMessage) -> list[str]:
+    lines = [
+        f"AGENT TOOL CALL: {tc['name']}({_dump_args(tc['args'])})"
+        for tc in msg.tool_calls
+    ]
+    if msg.content:
+        lines.append(f"AGENT: {msg.content}")
+    return lines
+
+
+# Tool results longer than this are cut short in the transcript
+TOOL_RESULT_PREVIEW = 500
+
+
+def _preview(text: str, limit: int = TOOL_RESULT_PREVIEW) -> str:
+    # A character past the limit means there's more to cut
+    return text[:limit] + "..." if text[limit:limit + 1] else text
+
+
+def _tool_entries(msg: ToolMessage) -> list[str]:
+    return [f"TOOL RESULT ({msg.name}): {_preview(msg.content)}"]
+
+
+# Message type → its transcript lines; unlisted types (the system prompt)
+# add nothing
+TRANSCRIPT_FORMATTERS = {
+    HumanMessage: lambda msg: [f"USER: {msg.content}"],
+    AIMessage: _ai_entries,
+    ToolMessage: _tool_entries,
+}
+
+
+def transcript_entries(msg) -> list[str]:
+    """Transcript lines for one message."""
+    formatter = TRANSCRIPT_FORMATTERS.get(type(msg))
+    return formatter(msg) if formatter else []
+
+
+def eval_user_id(turns: list[str]) -> str:
+    """The row's cart user — the same conversation gets the same user every run."""
+    digest = hashlib.sha256(json.dumps(turns).encode()).hexdigest()[:8]
+    return f"{EVAL_USER_ID}-{digest}"
+
+
+async def clear_eval_cart(db, user_id: str) -> None:
+    await db.execute(delete(CartItem).where(CartItem.user_id == user_id))
+    await db.commit()
+
+
 async def _run_e2e_conversation(turns: list[str]) -> dict:
     """Run a multi-turn conversation through the real agent graph.
 
     Sets up a real DB session and contextvars, then sends each turn
     through agent.ainvoke(), accumulating messages across turns.
 
+    Conversations run concurrently, so each gets its own session and its
+    own cart user (same EVAL_USER_ID prefix) — one row's add_to_cart
+    can't show up in another row's get_current_cart. The cart starts
+    empty and is cleared again when the row ends, however it ends.
+
     Returns all messages, plus details about the last turn's tool calls.
     """
     async with SessionLocal() as db:
         db_var.set(db)
-        user_id_var.set(EVAL_USER_ID)
+        user_id = eval_user_id(turns)
+        user_id_var.set(user_id)
+        # Leftovers from a run that died before its cleanup
+        await clear_eval_cart(db, user_id)
+
+        try:
+            # Accumulate messages across turns (the agent's "memory").
+            # The graph expects the system prompt as the first message.
+            all_messages = [SYSTEM_MESSAGE]
+            last_turn_tool_calls = []
+            # Readable transcript for the LLM-as-judge, built as messages arrive
+            transcript_lines: list[str] = []
+
+            for i, user_msg in enumerate(turns):
+                seen = len(all_messages)
+                all_messages.append(HumanMessage(content=user_msg))
+
+                # Run the full agent graph — it will call tools, loop, etc.
+                result = await agent.ainvoke({"messages": all_messages})
+                all_messages = result["messages"]
+                is_last_turn = i == len(turns) - 1
+
+                # Classify each message from this turn (incl. the user's) once
+                for msg in islice(all_messages, seen, None):
+                    transcript_lines.extend(transcript_entries(msg))
+                    if is_last_turn and isinstance(msg, AIMessage) and msg.tool_calls:
+                        # Last turn — capture tool calls for evaluation
+                        last_turn_tool_calls.extend(msg.tool_calls)
 
-        # Accumulate messages across turns (the agent's "memory")
-        all_messages = []
-        last_turn_tool_calls = []
+            transcript = "\n".join(transcript_lines)
 
-        for i, user_msg in enumerate(turns):
-            all_messages.append(HumanMessage(content=user_msg))
+            first_tool = last_turn_tool_calls[0]["name"] if last_turn_tool_calls else None
+            first_args = last_turn_tool_calls[0]["args"] if last_turn_tool_calls else None
 
-            # Run the full agent graph — it will call tools, loop, etc.
-            result = await agent.ainvoke({"messages": all_messages})
+            return {
+                "first_tool": first_tool,
+                "first_args": first_args,
+                "all_tools": [tc["name"] for tc in last_turn_tool_calls],
+                "transcript": transcript,
+            }
+        finally:
+            await db.rollback()  # whatever a failed turn left pending
+            await clear_eval_cart(db, user_id)
 
-            # Extract new messages added by this turn
-            new_messages = result["messages"][len(all_messages):]
-            all_messages = result["messages"]
 
-            # Track tool calls from this turn's AI messages
-            if i == len(turns) - 1:
-                # Last turn — capture tool calls for evaluation
-                for msg in new_messages:
-                    if isinstance(msg, AIMessage) and msg.tool_calls:
-                        last_turn_tool_calls.extend(msg.tool_calls)
+# Each row is several LLM + tool rounds; cap how many run at once.
+# Rows check sessions out of the app's engine pool (db_pool_size +
+# db_max_overflow = 60 by default): one per row, plus one per concurrent
+# catalog read in a tool round — keep this well under that.
+E2E_CONCURRENCY = 8
 
-        # Build a readable transcript for the LLM-as-judge
-        transcript_lines = []
-        for msg in all_messages:
-            if isinstance(msg, SystemMessage):
-                continue
-            elif isinstance(msg, HumanMessage):
-                transcript_lines.append(f"USER: {msg.content}")
-            elif isinstance(msg, AIMessage):
-                if msg.tool_calls:
-                    for tc in msg.tool_calls:
-                        transcript_lines.append(
-                            f"AGENT TOOL CALL: {tc['name']}({tc['args']})"
-                        )
-                if msg.content:
-                    transcript_lines.append(f"AGENT: {msg.content}")
-            elif isinstance(msg, ToolMessage):
-                # Truncate long tool results
-                content = msg.content[:500] + "..." if len(msg.content) > 500 else msg.content
-                transcript_lines.append(f"TOOL RESULT ({msg.name}): {content}")
-
-        transcript = "\n".join(transcript_lines)
-
-        first_tool = last_turn_tool_calls[0]["name"] if last_turn_tool_calls else None
-        first_args = last_turn_tool_calls[0]["args"] if last_turn_tool_calls else None
+# A conversation still running after this many seconds (a hung model call)
+# is scored as a failed row so it doesn't hold up the rest of the run
+E2E_ROW_TIMEOUT = 120.0
 
+
+async def apredict_e2e(inputs: dict) -> dict:
+    """End-to-end multi-turn prediction (target for LangSmith aevaluate)."""
+    key = eval_cache_key("e2e\x00" + json.dumps(inputs["turns"]))
+    if USE_EVAL_CACHE and key in _eval_cache:
+        return _eval_cache[key]
+
+    try:
+        outputs = await asyncio.wait_for(
+            _run_e2e_conversation(inputs["turns"]), timeout=E2E_ROW_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        # Not cached — the next run tries the conversation again
         return {
-            "first_tool": first_tool,
-            "first_args": first_args,
-            "all_tools": [tc["name"] for tc in last_turn_tool_calls],
-            "transcript": transcript,
+            "first_tool": None,
+            "first_args": None,
+            "all_tools": [],
+            "transcript": "[TIMEOUT]",
         }
+    _eval_cache[key] = outputs
+    return outputs
 
 
-def predict_e2e(inputs: dict) -> dict:
-    """End-to-end multi-turn prediction (sync wrapper for LangSmith evaluate)."""
-    turns = inputs["turns"]
-    return asyncio.run(_run_e2e_conversation(turns))
+# ── Evaluators ───────────────────────────────────────────────────────────────
 
+# "[ID:X] ... $price" on one line — product info in tool results and
+# agent messages (no DOTALL: a price never pairs with an ID lines away)
+ID_PRICE_RE = re.compile(r"\[ID:(\d+)\].*?\$(\d+(?:\.\d+)?)")
 
-# ── Evaluators ───────────────────────────────────────────────────────────────
 
 def correct_tool(outputs: dict, reference_outputs: dict) -> dict:
     """Score 1 if the first tool called matches the expected tool."""
@@ -242,14 +388,13 @@ def correct_product_picked(outputs: dict, reference_outputs: dict) -> dict:
 
     added_product_id = first_args.get("product_id")
 
-    # Parse all [ID:X] ... $price patterns from the transcript
-    # This captures product info from tool results and agent messages
+    # Parse all [ID:X] ... $price patterns from the transcript — the first
+    # price seen for each product wins
     product_prices = {}
-    for match in re.finditer(r"\[ID:(\d+)\].*?\$(\d+(?:\.\d+)?)", transcript):
+    for match in ID_PRICE_RE.finditer(transcript):
         pid = int(match.group(1))
-        price = float(match.group(2))
         if pid not in product_prices:
-            product_prices[pid] = price
+            product_prices[pid] = float(match.group(2))
 
     if len(product_prices) < 2:
         # Can't determine which is cheaper if we don't have 2+ products
@@ -263,25 +408,33 @@ def correct_product_picked(outputs: dict, reference_outputs: dict) -> dict:
 
 # ── Main ─────────────────────────────────────────────────────────────────────
 
-def run_single_turn(client: Client):
-    """Run single-turn tool selection eval."""
-    get_or_create_dataset(client, DATASET_NAME, EXAMPLES)
+async def run_single_turn(client: Client):
+    """Run single-turn tool selection eval (rows run concurrently)."""
+    # The sync LangSmith client would block the loop — and with mode "all"
+    # the other eval running on it
+    await asyncio.to_thread(get_or_create_dataset, client, DATASET_NAME, EXAMPLES)
 
     print("\nRunning single-turn evaluation...")
-    results = evaluate(
-        predict,
+    results = await aevaluate(
+        apredict,
         data=DATASET_NAME,
         evaluators=[correct_tool, tool_called],
         experiment_prefix="tool-selection",
+        client=client,
+        max_concurrency=SINGLE_TURN_CONCURRENCY,
     )
 
+    # Collect every row before printing — with mode "all" the other eval
+    # runs alongside, and its block mustn't land in the middle of this one
+    rows = [result async for result in results]
+
     print("\n" + "=" * 60)
     print("SINGLE-TURN RESULTS")
     print("=" * 60)
 
     correct_count = 0
     total = 0
-    for result in results:
+    for result in rows:
         total += 1
         user_input = result["run"].inputs["input"]
         expected = result["example"].outputs["expected_tool"]
@@ -294,11 +447,12 @@ def run_single_turn(client: Client):
         print(f"         expected={expected}, got={actual}")
 
     print(f"\nScore: {correct_count}/{total} correct")
+    save_eval_cache(_eval_cache)
     return results
 
 
-def run_e2e_multi_turn(client: Client):
-    """Run end-to-end multi-turn eval with real agent graph."""
+async def run_e2e_multi_turn(client: Client):
+    """Run end-to-end multi-turn eval with real agent graph (rows run concurrently)."""
 
     def build_e2e_inputs_outputs(ex):
         inputs = {"turns": ex["turns"]}
@@ -308,7 +462,8 @@ def run_e2e_multi_turn(client: Client):
         }
         return inputs, outputs
 
-    get_or_create_dataset(
+    await asyncio.to_thread(
+        get_or_create_dataset,
         client, E2E_DATASET_NAME, E2E_MULTI_TURN_EXAMPLES,
         build_inputs_outputs=build_e2e_inputs_outputs,
     )
@@ -316,18 +471,22 @@ def run_e2e_multi_turn(client: Client):
     print("\nRunning end-to-end multi-turn evaluation...")
     print("(This runs the full agent graph with real DB + Pinecone)\n")
 
-    mt_results = evaluate(
-        predict_e2e,
+    mt_results = await aevaluate(
+        apredict_e2e,
         data=E2E_DATASET_NAME,
         evaluators=[correct_tool, correct_product_picked],
         experiment_prefix="e2e-multi-turn",
+        client=client,
+        max_concurrency=E2E_CONCURRENCY,
     )
 
+    rows = [result async for result in mt_results]
+
     print("\n" + "=" * 60)
     print("E2E MULTI-TURN RESULTS")
     print("=" * 60)
 
-    for result in mt_results:
+    for result in rows:
         user_turns = result["run"].inputs["turns"]
         expected_tool = result["example"].outputs["expected_tool"]
         actual_tool = result["run"].outputs.get("first_tool")
@@ -345,25 +504,39 @@ def run_e2e_multi_turn(client: Client):
 
         # Print condensed transcript
         print(f"\n  Transcript:")
-        for line in transcript.split("\n"):
-            print(f"    | {line}")
+        # One write for the whole block (every line prefixed, blank ones too)
+        print(textwrap.indent(transcript, "    | ", lambda _: True))
 
+    save_eval_cache(_eval_cache)
     return mt_results
 
 
-def main():
-    client = Client()
+async def run_evals(client: Client, mode: str) -> list:
+    """Run the selected evals; with mode "all" both run at once."""
+    runs = []
+    if mode in ("all", "single"):
+        runs.append(run_single_turn(client))
+    if mode in ("all", "multi"):
+        runs.append(run_e2e_multi_turn(client))
+    # Independent experiments against LangSmith — overlap their waits
+    return await asyncio.gather(*runs)
 
-    # Parse CLI arg to select which eval to run
-    mode = sys.argv[1] if len(sys.argv) > 1 else "all"
 
-    all_results = []
+# LangSmith API calls (dataset reads, run and feedback uploads) wait at most
+# this long before the client's retry policy takes over
+LANGSMITH_TIMEOUT_MS = 30_000
 
-    if mode in ("all", "single"):
-        all_results.append(run_single_turn(client))
 
-    if mode in ("all", "multi"):
-        all_results.append(run_e2e_multi_turn(client))
+def main():
+    # One client for the whole run — both evals and aevaluate share its
+    # pooled HTTP session rather than aevaluate opening its own
+    client = Client(timeout_ms=LANGSMITH_TIMEOUT_MS)
+
+    # Parse CLI arg to select which eval to run
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    mode = args[0] if args else "all"
+
+    all_results = asyncio.run(run_evals(client, mode))
 
     # Dashboard links
     names = [r.experiment_name for r in all_results]
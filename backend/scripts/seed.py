@@ -5,7 +5,7 @@ from pathlib import Path
 # Allow imports from backend/app
 sys.path.append(str(Path(__file__).parent.parent))
 
-from sqlalchemy import select
+from sqlalchemy import insert, select
 from app.database import SessionLocal
 from app.models import Product
 
@@ -183,15 +183,15 @@ PRODUCTS = [
 async def seed():
     async with SessionLocal() as db:
         # Skip if already seeded
-        result = await db.execute(select(Product))
-        if result.scalars().first():
+        result = await db.execute(select(Product.id).limit(1))
+        if result.first():
             print("Database already seeded, skipping.")
             return
 
-        products = [Product(**p) for p in PRODUCTS]
-        db.add_all(products)
+        # Core executemany — no Product objects or identity-map bookkeeping
+        await db.execute(insert(Product), PRODUCTS)
         await db.commit()
-        print(f"Seeded {len(products)} products.")
+        print(f"Seeded {len(PRODUCTS)} products.")
 
 
 if __name__ == "__main__":
@@ -3,6 +3,10 @@ One-time script: embed all products and store them in Pinecone.
 
 Run after seeding the database:
     uv run python scripts/seed_embeddings.py
+
+Re-run it after changing the metadata below — semantic_search filters on
+price and category in Pinecone, and vectors without those fields never
+match a filtered search.
 """
 import asyncio
 import sys
@@ -16,40 +20,65 @@ from app.models import Product
 from app.services.embeddings import build_product_text, embed_texts
 from app.services.vector_store import upsert_products
 
+# Products per embeddings request, and how many requests run at once
+# (bounded so a large catalog doesn't trip OpenAI's rate limits)
+EMBED_CHUNK_SIZE = 64
+EMBED_CONCURRENCY = 8
+
+
+async def embed_in_chunks(texts: list[str]) -> list[list[float]]:
+    """embed_texts over chunks of EMBED_CHUNK_SIZE, with requests overlapped."""
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed_chunk(chunk: list[str]) -> list[list[float]]:
+        async with semaphore:
+            return await embed_texts(chunk)
+
+    chunks = [texts[i:i + EMBED_CHUNK_SIZE] for i in range(0, len(texts), EMBED_CHUNK_SIZE)]
+    results = await asyncio.gather(*(embed_chunk(c) for c in chunks))
+    # gather keeps chunk order, and each chunk keeps input order
+    return [vector for chunk_vectors in results for vector in chunk_vectors]
+
 
 async def main():
+    # One pass over the rows: only the columns we embed or store, streamed
+    # (no Product objects), split into the text to embed and its metadata
+    ids: list[str] = []
+    texts: list[str] = []
+    metadata: list[dict] = []
     async with SessionLocal() as db:
-        result = await db.execute(select(Product))
-        products = result.scalars().all()
+        rows = await db.stream(select(
+            Product.id, Product.name, Product.description,
+            Product.category, Product.brand, Product.price,
+        ))
+        async for p in rows:
+            ids.append(str(p.id))  # Pinecone ID must be a string
+            texts.append(build_product_text(p))
+            metadata.append({
+                "product_id": p.id,
+                "name": p.name,
+                "category": p.category.lower(),
+                "price": float(p.price),
+            })
 
-    if not products:
+    if not texts:
         print("No products found. Run seed.py first.")
         return
 
-    print(f"Embedding {len(products)} products...")
-
-    # Build the text for each product
-    texts = [build_product_text(p) for p in products]
+    print(f"Embedding {len(texts)} products...")
 
-    # One batched API call for all products (efficient)
-    vectors = await embed_texts(texts)
+    # Batched API calls, several in flight at once
+    vectors = await embed_in_chunks(texts)
 
     # Prepare records for Pinecone: (id, vector, metadata)
-    records = [
-        (
-            str(p.id),                        # Pinecone ID must be a string
-            vectors[i],                        # 1536-dim embedding
-            {"product_id": p.id, "name": p.name, "category": p.category},
-        )
-        for i, p in enumerate(products)
-    ]
+    records = list(zip(ids, vectors, metadata))
 
     upsert_products(records)
     print(f"Done! {len(records)} products stored in Pinecone.")
 
     # Show a sample so you can see what was embedded
     print("\nSample embedded text:")
-    print(f"  [{products[0].name}]")
+    print(f"  [{metadata[0]['name']}]")
     print(f"  → '{texts[0]}'")
 
 
@@ -7,19 +7,45 @@ Usage:
     uv run python scripts/test_search.py "lightweight" --category packs
 """
 import asyncio
+import hashlib
 import sys
+from array import array
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.database import SessionLocal
-from app.services.embeddings import embed_text
+from app.services.embeddings import (
+    cache_query_vector,
+    embed_vector,
+    normalize_query,
+)
 from app.services.vector_store import search_similar
 from app.services.search import semantic_search
 from app.agent.context import db_var, user_id_var
 from app.agent.tools import search_products
 
 
+# Query vectors from earlier runs, one raw float32 file per query — re-running
+# the script while tweaking filters doesn't pay for the embedding again
+EMBED_CACHE_DIR = Path(__file__).parent / ".embed_cache"
+
+
+async def cached_embed(query: str) -> list[float]:
+    """Embed a query, reusing the vector saved by an earlier run."""
+    key = normalize_query(query)
+    path = EMBED_CACHE_DIR / f"{hashlib.sha256(key.encode()).hexdigest()}.f32"
+    if path.exists():
+        vector = array("f", path.read_bytes())
+    else:
+        vector = await embed_vector(key)
+        EMBED_CACHE_DIR.mkdir(exist_ok=True)
+        path.write_bytes(vector.tobytes())
+    # Seed the in-process LRU too, so the layers' own embed_query calls hit
+    cache_query_vector(key, vector)
+    return vector.tolist()
+
+
 def parse_args():
     args = sys.argv[1:]
     if not args:
@@ -39,6 +65,28 @@ def parse_args():
     return query, max_price, category
 
 
+async def full_search(query: str, max_price, category):
+    """Layer 2: Pinecone + PostgreSQL, on its own session."""
+    async with SessionLocal() as db:
+        return await semantic_search(
+            query=query, db=db, max_price=max_price, category=category,
+        )
+
+
+async def tool_search(query: str, max_price, category) -> str:
+    """Layer 3: the agent tool, on its own session (sessions can't be shared
+    between concurrent awaits)."""
+    async with SessionLocal() as db:
+        db_var.set(db)
+        user_id_var.set("test_user")
+        tool_args = {"query": query}
+        if max_price:
+            tool_args["max_price"] = max_price
+        if category:
+            tool_args["category"] = category
+        return await search_products.ainvoke(tool_args)
+
+
 async def main():
     query, max_price, category = parse_args()
 
@@ -48,42 +96,51 @@ async def main():
     if category:
         print(f"Category: {category}")
 
+    # Embed once and seed the query cache — layers 2 and 3 embed the same
+    # query internally and get this vector back without another API call.
+    # The layers are independent, so all three run at once.
+    vec = await cached_embed(query)
+    # return_exceptions: one layer failing mustn't hide the others' output
+    matches, products, result = await asyncio.gather(
+        search_similar(vec, top_k=5),
+        full_search(query, max_price, category),
+        tool_search(query, max_price, category),
+        return_exceptions=True,
+    )
+    passed = True
+
     # Layer 1: Pinecone
     print("\n── Layer 1: Pinecone (vector search) ──")
-    vec = await embed_text(query)
-    matches = search_similar(vec, top_k=5)
-    if not matches:
+    if isinstance(matches, Exception):
+        print(f"  ❌ Failed: {matches!r}")
+        passed = False
+    elif not matches:
         print("  ❌ No matches from Pinecone")
-        return
-    for m in matches:
-        print(f"  ✅ ID:{m.id}  score:{m.score:.4f}  {m.metadata.get('name', '?')}")
+        passed = False
+    else:
+        for m in matches:
+            print(f"  ✅ ID:{m.id}  score:{m.score:.4f}  {m.metadata.get('name', '?')}")
 
     # Layer 2: Full search (Pinecone + PostgreSQL)
     print("\n── Layer 2: Full search (Pinecone + PostgreSQL) ──")
-    async with SessionLocal() as db:
-        products = await semantic_search(
-            query=query, db=db, max_price=max_price, category=category,
-        )
-        if not products:
-            print("  ❌ No products after SQL filtering")
-        else:
-            for p in products:
-                print(f"  ✅ ID:{p.id} {p.name} — ${p.price} (stock:{p.stock})")
+    if isinstance(products, Exception):
+        print(f"  ❌ Failed: {products!r}")
+        passed = False
+    elif not products:
+        print("  ❌ No products after SQL filtering")
+    else:
+        for p in products:
+            print(f"  ✅ ID:{p.id} {p.name} — ${p.price} (stock:{p.stock})")
 
     # Layer 3: Tool (what the agent sees)
     print("\n── Layer 3: Agent tool output ──")
-    async with SessionLocal() as db:
-        db_var.set(db)
-        user_id_var.set("test_user")
-        tool_args = {"query": query}
-        if max_price:
-            tool_args["max_price"] = max_price
-        if category:
-            tool_args["category"] = category
-        result = await search_products.ainvoke(tool_args)
+    if isinstance(result, Exception):
+        print(f"  ❌ Failed: {result!r}")
+        passed = False
+    else:
         print(result)
 
-    print("\n✅ All layers passed")
+    print("\n✅ All layers passed" if passed else "\n❌ Some layers failed")
 
 
 if __name__ == "__main__":
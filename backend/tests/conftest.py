@@ -4,15 +4,23 @@ Test fixtures shared across all test files.
 Key decisions:
   - We use the SAME database as dev (aishop) but clean up after each test.
     In production you'd use a separate test database, but for learning this is simpler.
-  - Each test gets its own DB session that rolls back after the test,
-    so tests never leave dirty data behind.
+  - The whole run shares one connection and one outer transaction, rolled
+    back at the end, so tests never leave dirty data behind. The sample
+    products are inserted into it once; each test runs in a SAVEPOINT on
+    top that rolls back after the test.
   - We override FastAPI's get_db dependency to use the test session.
 """
 from typing import AsyncGenerator
 
 import pytest_asyncio
 from httpx import ASGITransport, AsyncClient
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
 
 from app.config import settings
 from app.database import Base, get_db
@@ -20,81 +28,130 @@ from app.main import app
 from app.models import Product, CartItem
 
 
-@pytest_asyncio.fixture
-async def db() -> AsyncGenerator[AsyncSession, None]:
+@pytest_asyncio.fixture(scope="session")
+async def engine() -> AsyncGenerator[AsyncEngine, None]:
     """
-    Provide a test DB session that rolls back after each test.
+    One pooled engine for the whole test run.
+
+    Tests and fixtures all run on the session event loop (see
+    asyncio_default_*_loop_scope in pyproject.toml), so pooled connections
+    are never used from a loop other than the one that opened them — no
+    test reconnects to Postgres.
+    """
+    engine = create_async_engine(settings.database_url, pool_size=5, max_overflow=10)
+    yield engine
+    await engine.dispose()
+
+
+# The baseline catalog, seeded once per test run (see sample_products)
+SAMPLE_PRODUCTS = [
+    dict(
+        name="Test Rain Jacket",
+        description="Waterproof jacket for rainy hikes",
+        price=74.99,
+        category="jackets",
+        brand="TestBrand",
+        stock=10,
+    ),
+    dict(
+        name="Test Hiking Boots",
+        description="Sturdy boots for mountain trails",
+        price=89.99,
+        category="footwear",
+        brand="TestBrand",
+        stock=5,
+    ),
+    dict(
+        name="Test Sleeping Bag",
+        description="Warm sleeping bag for cold nights",
+        price=149.99,
+        category="sleeping",
+        brand="TestBrand",
+        stock=0,  # out of stock — useful for testing filters
+    ),
+]
+
+
+@pytest_asyncio.fixture(scope="session")
+async def connection(engine: AsyncEngine) -> AsyncGenerator[AsyncConnection, None]:
+    """
+    One connection and outer transaction for the whole run, with the
+    sample products already in it.
 
-    We create the engine INSIDE the fixture so it's always bound to
-    the current event loop. A module-level engine would be created on
-    import (one loop) but used in tests (different loop per function),
-    causing "Future attached to a different loop" errors.
+    Seeding here (not per test) inserts them once; the rollback at the end
+    removes them again.
     """
-    engine = create_async_engine(settings.database_url)
     async with engine.connect() as conn:
         trans = await conn.begin()
-        session = AsyncSession(bind=conn, expire_on_commit=False)
+        result = await conn.execute(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            SAMPLE_PRODUCTS,
+        )
+        conn.info["sample_product_ids"] = result.scalars().all()
 
-        yield session
+        yield conn
 
-        await session.close()
         await trans.rollback()
-    await engine.dispose()
 
 
 @pytest_asyncio.fixture
-async def client(db: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
+async def db(connection: AsyncConnection) -> AsyncGenerator[AsyncSession, None]:
     """
-    HTTP test client that uses the test DB session.
+    Provide a test DB session that rolls back after each test.
 
-    We override get_db so all endpoint code uses our rolled-back session.
+    Everything the test does happens inside a SAVEPOINT on the shared
+    connection — a commit inside a test only releases a nested savepoint,
+    and the rollback below undoes it all, leaving the seed rows as they were.
     """
-    async def override_get_db():
-        yield db
+    savepoint = await connection.begin_nested()
+    session = AsyncSession(
+        bind=connection,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint",
+    )
 
-    app.dependency_overrides[get_db] = override_get_db
+    yield session
 
+    await session.close()
+    await savepoint.rollback()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def http_client() -> AsyncGenerator[AsyncClient, None]:
+    """One in-process HTTP client for the whole run (see client)."""
     async with AsyncClient(
         transport=ASGITransport(app=app),
         base_url="http://test",
     ) as c:
         yield c
 
+
+@pytest_asyncio.fixture
+async def client(http_client: AsyncClient, db: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
+    """
+    HTTP test client that uses the test DB session.
+
+    We override get_db so all endpoint code uses our rolled-back session.
+    The client itself is shared; only the override changes per test.
+    """
+    async def override_get_db():
+        yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+
+    yield http_client
+
     app.dependency_overrides.clear()
 
 
 @pytest_asyncio.fixture
-async def sample_products(db: AsyncSession) -> list[Product]:
-    """Seed 3 test products into the database."""
-    products = [
-        Product(
-            name="Test Rain Jacket",
-            description="Waterproof jacket for rainy hikes",
-            price=74.99,
-            category="jackets",
-            brand="TestBrand",
-            stock=10,
-        ),
-        Product(
-            name="Test Hiking Boots",
-            description="Sturdy boots for mountain trails",
-            price=89.99,
-            category="footwear",
-            brand="TestBrand",
-            stock=5,
-        ),
-        Product(
-            name="Test Sleeping Bag",
-            description="Warm sleeping bag for cold nights",
-            price=149.99,
-            category="sleeping",
-            brand="TestBrand",
-            stock=0,  # out of stock — useful for testing filters
-        ),
-    ]
-    db.add_all(products)
-    await db.flush()  # assigns IDs without committing
-    return products
+async def sample_products(db: AsyncSession, connection: AsyncConnection) -> list[Product]:
+    """The 3 seeded test products, loaded into this test's session."""
+    ids = connection.info["sample_product_ids"]
+    products = await db.scalars(
+        select(Product).where(Product.id.in_(ids)).order_by(Product.id)
+    )
+    return list(products)
 
 
 @pytest_asyncio.fixture
@@ -5,11 +5,19 @@ These test the "wiring" — does the graph route correctly?
 Does the guardrail reject oversized messages?
 No LLM calls needed for most of these.
 """
+import asyncio
 import json
+import re
+from unittest.mock import AsyncMock, patch
 
-from langchain_core.messages import AIMessage, HumanMessage
+import orjson
+import pytest
 
-from app.agent.graph import should_continue
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.agent.graph import SYSTEM_MESSAGE, llm, llm_with_tools, should_continue
+from app.api.chat import MAX_MESSAGE_LENGTH
 
 
 # ── should_continue (routing logic) ─────────────────────────────────────────
@@ -38,14 +46,34 @@ def test_should_continue_empty_tool_calls():
     assert should_continue(state) == "end"
 
 
+# ── LLM response cache ──────────────────────────────────────────────────────
+
+async def test_identical_prompt_served_from_cache():
+    """A repeated (system, history, tools) prompt doesn't hit the API again."""
+    fake_result = ChatResult(generations=[ChatGeneration(message=AIMessage(content="cached"))])
+    messages = [SYSTEM_MESSAGE, HumanMessage(content="test_identical_prompt_served_from_cache")]
+
+    with patch.object(
+        type(llm), "_agenerate", new_callable=AsyncMock, return_value=fake_result,
+    ) as mock_generate:
+        first = await llm_with_tools.ainvoke(messages)
+        second = await llm_with_tools.ainvoke(messages)
+
+    mock_generate.assert_called_once()
+    assert first.content == second.content == "cached"
+
+
 # ── Guardrails (via streaming endpoint) ──────────────────────────────────────
 
+AT_LIMIT_MESSAGE = "x" * MAX_MESSAGE_LENGTH
+OVER_LIMIT_MESSAGE = AT_LIMIT_MESSAGE + "x"
+
+
 async def test_message_too_long_rejected(client):
     """Messages over MAX_MESSAGE_LENGTH get a friendly rejection via SSE."""
-    long_message = "x" * 2001  # MAX_MESSAGE_LENGTH is 2000
     response = await client.post("/api/chat/stream", json={
         "user_id": "test_user",
-        "message": long_message,
+        "message": OVER_LIMIT_MESSAGE,
     })
     assert response.status_code == 200  # SSE always returns 200
 
@@ -63,10 +91,9 @@ async def test_message_too_long_rejected(client):
 
 async def test_message_at_limit_accepted(client):
     """A message exactly at MAX_MESSAGE_LENGTH should NOT be rejected."""
-    exact_message = "x" * 2000
     response = await client.post("/api/chat/stream", json={
         "user_id": "test_user",
-        "message": exact_message,
+        "message": AT_LIMIT_MESSAGE,
     })
     assert response.status_code == 200
 
@@ -78,6 +105,112 @@ async def test_message_at_limit_accepted(client):
         assert "too long" not in token_events[0].get("content", "").lower()
 
 
+# ── Streaming loop (LLM mocked) ──────────────────────────────────────────────
+
+async def test_stream_plain_reply_uses_one_llm_call(client):
+    """A reply without tool calls is streamed from the first (and only) LLM call."""
+    llm = _FakeStreamingLLM([[AIMessageChunk(content="Hel"), AIMessageChunk(content="lo!")]])
+    with patch("app.api.chat.llm_with_tools", llm):
+        response = await client.post("/api/chat/stream", json={
+            "user_id": "test_user",
+            "message": "hi",
+        })
+
+    events = _parse_sse(response.text)
+    tokens = [e["content"] for e in events if e.get("type") == "token"]
+    assert tokens == ["Hel", "lo!"]
+    assert llm.calls == 1
+    assert events[-1]["type"] == "done"
+
+    # The turn is persisted once the stream finishes
+    saved = await client.get(f"/api/chat/{events[-1]['conversation_id']}/messages")
+    assert [(m["role"], m["content"]) for m in saved.json()] == [
+        ("user", "hi"),
+        ("assistant", "Hello!"),
+    ]
+
+
+async def test_stream_saves_turn_before_done(client):
+    """The turn is committed before "done" goes out — the client reloads on done."""
+    from app.api import chat
+
+    order = []
+    real_save, real_event = chat.save_messages, chat.sse_event
+
+    async def save_messages(*args):
+        order.append("save")
+        return await real_save(*args)
+
+    def sse_event(data):
+        order.append(data["type"])
+        return real_event(data)
+
+    llm = _FakeStreamingLLM([[AIMessageChunk(content="Hi")]])
+    with (
+        patch("app.api.chat.llm_with_tools", llm),
+        patch("app.api.chat.save_messages", save_messages),
+        patch("app.api.chat.sse_event", sse_event),
+    ):
+        await client.post("/api/chat/stream", json={"user_id": "test_user", "message": "hi"})
+
+    assert order[-2:] == ["save", "done"]
+
+
+async def test_stream_tool_call_then_reply(client):
+    """Streamed tool_call_chunks are merged and dispatched before the next round."""
+    tool_chunk = AIMessageChunk(
+        content="",
+        tool_call_chunks=[{"name": "get_current_cart", "args": "{}", "id": "call_1", "index": 0}],
+    )
+    llm = _FakeStreamingLLM([[tool_chunk], [AIMessageChunk(content="Your cart is empty.")]])
+    with patch("app.api.chat.llm_with_tools", llm):
+        response = await client.post("/api/chat/stream", json={
+            "user_id": "test_user",
+            "message": "what's in my cart?",
+        })
+
+    events = _parse_sse(response.text)
+    statuses = [e["content"] for e in events if e.get("type") == "status"]
+    tokens = [e["content"] for e in events if e.get("type") == "token"]
+    assert "Checking your cart..." in statuses
+    assert tokens == ["Your cart is empty."]
+    assert llm.calls == 2
+
+
+async def test_stream_releases_connection_during_llm_calls(client, db):
+    """No transaction (so no pooled connection) is held while the LLM runs."""
+    tool_chunk = AIMessageChunk(
+        content="",
+        tool_call_chunks=[{"name": "get_current_cart", "args": "{}", "id": "call_1", "index": 0}],
+    )
+    llm = _FakeStreamingLLM([[tool_chunk], [AIMessageChunk(content="Your cart is empty.")]], db=db)
+    with patch("app.api.chat.llm_with_tools", llm):
+        await client.post("/api/chat/stream", json={
+            "user_id": "test_user",
+            "message": "what's in my cart?",
+        })
+
+    assert llm.in_transaction == [False, False]
+
+
+async def test_chat_runs_tool_loop_without_graph(client):
+    """POST /api/chat runs tool rounds in a plain loop and returns the final reply."""
+    tool_chunk = AIMessageChunk(
+        content="",
+        tool_call_chunks=[{"name": "get_current_cart", "args": "{}", "id": "call_1", "index": 0}],
+    )
+    llm = _FakeStreamingLLM([[tool_chunk], [AIMessageChunk(content="Your cart is empty.")]])
+    with patch("app.api.chat.llm_with_tools", llm):
+        response = await client.post("/api/chat", json={
+            "user_id": "test_user",
+            "message": "what's in my cart?",
+        })
+
+    assert response.status_code == 200
+    assert response.json()["reply"] == "Your cart is empty."
+    assert llm.calls == 2
+
+
 # ── SSE format helper ────────────────────────────────────────────────────────
 
 def test_sse_event_format():
@@ -85,24 +218,115 @@ def test_sse_event_format():
     from app.api.chat import sse_event
 
     result = sse_event({"type": "token", "content": "hello"})
-    assert result.startswith("data: ")
-    assert result.endswith("\n\n")
+    assert result.startswith(b"data: ")
+    assert result.endswith(b"\n\n")
 
-    parsed = json.loads(result.removeprefix("data: ").strip())
+    parsed = json.loads(result.removeprefix(b"data: ").strip())
     assert parsed["type"] == "token"
     assert parsed["content"] == "hello"
 
 
+def test_sse_event_keeps_unicode():
+    """Non-ASCII tokens round-trip (sent as UTF-8, not \\u escapes)."""
+    from app.api.chat import sse_event
+
+    result = sse_event({"type": "token", "content": "20°F — ok"})
+    assert "20°F — ok".encode() in result
+    assert json.loads(result.removeprefix(b"data: "))["content"] == "20°F — ok"
+
+
+def test_token_event_matches_sse_event():
+    from app.api.chat import sse_event, token_event
+
+    for token in ["hello", 'say "hi"\n', "20°F — ok", ""]:
+        assert token_event(token) == sse_event({"type": "token", "content": token})
+
+
+async def test_with_keepalive_pings_while_quiet():
+    """Silence longer than the interval is filled with SSE comments."""
+    from app.api.chat import KEEPALIVE_EVENT, with_keepalive
+
+    async def slow_events():
+        await asyncio.sleep(0.05)
+        yield b"data: 1\n\n"
+
+    received = [event async for event in with_keepalive(slow_events(), interval=0.01)]
+    assert received[-1] == b"data: 1\n\n"
+    assert KEEPALIVE_EVENT in received[:-1]
+
+
+async def test_with_keepalive_reraises_errors():
+    from app.api.chat import with_keepalive
+
+    async def failing_events():
+        yield b"data: 1\n\n"
+        raise RuntimeError("boom")
+
+    received = []
+    with pytest.raises(RuntimeError):
+        async for event in with_keepalive(failing_events(), interval=1):
+            received.append(event)
+    assert received == [b"data: 1\n\n"]
+
+
+async def test_with_keepalive_close_waits_for_cleanup():
+    """Closing early (client disconnect) finishes the events' cleanup first."""
+    from app.api.chat import with_keepalive
+
+    cleaned_up = []
+
+    async def endless_events():
+        try:
+            while True:
+                yield b"data: 1\n\n"
+                await asyncio.sleep(1)
+        finally:
+            await asyncio.sleep(0)  # async cleanup, like closing a session
+            cleaned_up.append(True)
+
+    stream = with_keepalive(endless_events(), interval=10)
+    assert await anext(stream) == b"data: 1\n\n"
+    await stream.aclose()
+    assert cleaned_up == [True]
+
+
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
+class _FakeStreamingLLM:
+    """Stands in for llm_with_tools: each call answers with the next list of chunks."""
+
+    def __init__(self, rounds: list[list[AIMessageChunk]], db=None):
+        self.rounds = rounds
+        self.calls = 0
+        self.db = db
+        self.in_transaction: list[bool] = []  # db state at each call
+
+    def _next_round(self) -> list[AIMessageChunk]:
+        if self.db is not None:
+            self.in_transaction.append(self.db.in_transaction())
+        chunks = self.rounds[self.calls]
+        self.calls += 1
+        return chunks
+
+    async def ainvoke(self, messages, config=None):
+        chunks = self._next_round()
+        return sum(chunks[1:], chunks[0])
+
+    async def astream(self, messages, config=None):
+        for chunk in self._next_round():
+            yield chunk
+
+
+# One data payload per match, found in a single pass over the body
+SSE_DATA_RE = re.compile(r"^data: (.+)$", re.MULTILINE)
+
+
 def _parse_sse(text: str) -> list[dict]:
     """Parse SSE response body into a list of event dicts."""
     events = []
-    for line in text.strip().split("\n"):
-        line = line.strip()
-        if line.startswith("data: "):
-            try:
-                events.append(json.loads(line[6:]))
-            except json.JSONDecodeError:
-                pass
+    for payload in SSE_DATA_RE.findall(text):
+        try:
+            events.append(orjson.loads(payload))
+        except orjson.JSONDecodeError:
+            pass
     return events
@@ -1,4 +1,7 @@
 """Tests for cart endpoints: GET /api/cart/:user_id, POST /api/cart, DELETE /api/cart/:item_id."""
+import pytest
+
+from app.models import CartItem
 
 
 async def test_get_empty_cart(client):
@@ -27,17 +30,47 @@ async def test_add_to_cart(client, sample_products):
     assert data["product"]["name"] == "Test Rain Jacket"
 
 
-async def test_add_to_cart_upsert(client, sample_products):
-    """Adding the same product twice increases quantity (upsert)."""
+@pytest.mark.parametrize(("initial", "added", "expected"), [(1, 1, 2), (3, 2, 5)])
+async def test_add_to_cart_upsert(client, db, sample_products, initial, added, expected):
+    """Adding a product already in the cart increases its quantity (upsert)."""
     product = sample_products[0]
-    payload = {"user_id": "test_user", "product_id": product.id, "quantity": 1}
+    db.add(CartItem(user_id="test_user", product_id=product.id, quantity=initial))
+    await db.flush()
 
-    await client.post("/api/cart", json=payload)
-    response = await client.post("/api/cart", json=payload)
+    response = await client.post("/api/cart", json={
+        "user_id": "test_user",
+        "product_id": product.id,
+        "quantity": added,
+    })
     assert response.status_code == 201
+    assert response.json()["quantity"] == expected
 
-    data = response.json()
-    assert data["quantity"] == 2  # 1 + 1
+
+async def test_add_to_cart_product_not_in_session(client, db, sample_products):
+    """The response includes the product even when the session hasn't loaded it yet."""
+    product_id = sample_products[0].id
+    db.expunge_all()  # as under the real get_db: nothing in the identity map
+
+    response = await client.post("/api/cart", json={
+        "user_id": "test_user",
+        "product_id": product_id,
+        "quantity": 1,
+    })
+    assert response.status_code == 201
+    assert response.json()["product"]["name"] == "Test Rain Jacket"
+
+
+async def test_add_to_cart_upsert_keeps_single_row(client, sample_products):
+    """Repeated adds update one row (ON CONFLICT) instead of inserting duplicates."""
+    product = sample_products[0]
+    payload = {"user_id": "test_user", "product_id": product.id, "quantity": 1}
+
+    first = await client.post("/api/cart", json=payload)
+    second = await client.post("/api/cart", json=payload)
+    assert first.json()["id"] == second.json()["id"]
+
+    cart = await client.get("/api/cart/test_user")
+    assert len(cart.json()["items"]) == 1
 
 
 async def test_add_to_cart_product_not_found(client):
@@ -22,13 +22,12 @@ async def test_load_messages(client, db):
     response = await client.get(f"/api/chat/{convo_id}/messages")
     assert response.status_code == 200
 
-    data = response.json()
-    assert len(data) == 3
-    # All messages present (order may vary when timestamps are identical)
-    contents = {m["content"] for m in data}
-    assert "Hi there" in contents
-    assert "Hello! How can I help?" in contents
-    assert "Show me jackets" in contents
+    # In insertion order — equal timestamps (one transaction) tie-break on id
+    assert [m["content"] for m in response.json()] == [
+        "Hi there",
+        "Hello! How can I help?",
+        "Show me jackets",
+    ]
 
 
 async def test_messages_scoped_to_conversation(client, db):
@@ -40,6 +39,4 @@ async def test_messages_scoped_to_conversation(client, db):
     await db.flush()
 
     response = await client.get("/api/chat/convo-a/messages")
-    data = response.json()
-    assert len(data) == 1
-    assert data[0]["content"] == "msg in A"
+    assert [m["content"] for m in response.json()] == ["msg in A"]
@@ -5,6 +5,7 @@ and the sliding window + summarization logic.
 build_context over-budget calls the real LLM (gpt-4o-mini) for summarization,
 so we mock it to keep tests fast and free.
 """
+from collections import OrderedDict
 from unittest.mock import AsyncMock, patch
 
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
@@ -13,9 +14,12 @@ from app.models import Message
 from app.services.context_manager import (
     MAX_HISTORY_TOKENS,
     MIN_RECENT_MESSAGES,
+    WINDOW_STEP,
     build_context,
     count_tokens,
+    count_tokens_batch,
     messages_to_langchain,
+    recent_window_start,
 )
 
 
@@ -37,6 +41,16 @@ def test_count_tokens_longer():
     assert long > short
 
 
+def test_count_tokens_batch_matches_single():
+    texts = ["hello world", "", "This is a much longer sentence with many words in it"]
+    assert count_tokens_batch(texts) == [count_tokens(t) for t in texts]
+
+
+def test_count_tokens_special_token_text():
+    """Special-token text in user input is counted, not rejected."""
+    assert count_tokens("<|endoftext|>") > 0
+
+
 # ── messages_to_langchain ────────────────────────────────────────────────────
 
 def test_messages_to_langchain_converts_roles():
@@ -59,6 +73,21 @@ def test_messages_to_langchain_empty():
     assert messages_to_langchain([]) == []
 
 
+# ── recent_window_start ──────────────────────────────────────────────────────
+
+def test_recent_window_fits_budget():
+    """Keeps the newest messages whose running total fits the budget."""
+    per_message = MAX_HISTORY_TOKENS // 10
+    counts = [per_message] * 25
+    assert recent_window_start(counts) == 15
+
+
+def test_recent_window_keeps_min_recent_over_budget():
+    """MIN_RECENT_MESSAGES are kept even when they alone exceed the budget."""
+    counts = [MAX_HISTORY_TOKENS] * (MIN_RECENT_MESSAGES + 4)
+    assert recent_window_start(counts) == 4
+
+
 # ── build_context ────────────────────────────────────────────────────────────
 
 async def test_build_context_empty():
@@ -84,7 +113,7 @@ async def test_build_context_under_budget():
 async def test_build_context_over_budget_triggers_summarization():
     """
     When total tokens exceed MAX_HISTORY_TOKENS, older messages get
-    summarized and only MIN_RECENT_MESSAGES are kept verbatim.
+    summarized and only the newest messages that fit the budget are kept verbatim.
     """
     # Create enough messages to exceed the token budget.
     # Each message ~100 tokens, we need > MAX_HISTORY_TOKENS total.
@@ -108,8 +137,14 @@ async def test_build_context_over_budget_triggers_summarization():
         # summarize_messages should have been called once
         mock_summarize.assert_called_once()
 
-        # Result should be: [summary SystemMessage] + MIN_RECENT_MESSAGES
-        assert len(result) == MIN_RECENT_MESSAGES + 1
+        # Result should be: [summary SystemMessage] + recent messages. The
+        # split sits on a WINDOW_STEP boundary, at or before the budget split.
+        recent = result[1:]
+        split = num_messages - len(recent)
+        counts = count_tokens_batch([m.content for m in db_messages])
+        assert MIN_RECENT_MESSAGES <= len(recent) < num_messages
+        assert split % WINDOW_STEP == 0
+        assert recent_window_start(counts) - WINDOW_STEP < split <= recent_window_start(counts)
 
         # First message is the summary
         assert isinstance(result[0], SystemMessage)
@@ -120,6 +155,54 @@ async def test_build_context_over_budget_triggers_summarization():
         assert f"Message {num_messages - 1}" in result[-1].content
 
 
+async def test_build_context_prefix_stable_across_turns():
+    """
+    Consecutive turns share the same summary and verbatim prefix, and the
+    summary is only generated once while the split stays put.
+    """
+    filler = "This is a detailed message about outdoor gear products. " * 20
+    db_messages = []
+    for i in range(32):
+        role = "user" if i % 2 == 0 else "assistant"
+        db_messages.append(_make_message(role, f"Message {i}: {filler}", id=i + 1, conversation_id="stable"))
+
+    with patch(
+        "app.services.context_manager.summarize_messages",
+        new_callable=AsyncMock,
+        return_value="Earlier: browsed jackets.",
+    ) as mock_summarize:
+        first = await build_context(db_messages[:30])
+        second = await build_context(db_messages)
+
+        mock_summarize.assert_called_once()
+
+    # The next turn only appends to the previous context
+    assert second[:len(first)] == first
+    assert len(second) == len(first) + 2
+
+
+async def test_build_context_reuses_stored_summary(db):
+    """A summary saved by one worker is reused by another (empty in-process cache)."""
+    filler = "This is a detailed message about outdoor gear products. " * 20
+    db_messages = []
+    for i in range(30):
+        role = "user" if i % 2 == 0 else "assistant"
+        db_messages.append(_make_message(role, f"Message {i}: {filler}", id=i + 1, conversation_id="stored"))
+
+    with patch(
+        "app.services.context_manager.summarize_messages",
+        new_callable=AsyncMock,
+        return_value="Earlier: browsed jackets.",
+    ) as mock_summarize:
+        first = await build_context(db_messages, db)
+        with patch("app.services.context_manager._summary_cache", OrderedDict()):
+            second = await build_context(db_messages, db)
+
+        mock_summarize.assert_called_once()
+
+    assert second == first
+
+
 async def test_build_context_few_messages_no_summarization():
     """
     Even if messages are long, if there are <= MIN_RECENT_MESSAGES,
@@ -145,6 +228,7 @@ async def test_build_context_few_messages_no_summarization():
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
-def _make_message(role: str, content: str) -> Message:
+def _make_message(role: str, content: str, **kwargs) -> Message:
     """Create a Message object without hitting the database."""
-    return Message(role=role, content=content, conversation_id="test")
+    kwargs.setdefault("conversation_id", "test")
+    return Message(role=role, content=content, **kwargs)
@@ -0,0 +1,53 @@
+"""
+Tests for the query-embedding cache.
+
+embed_vector is mocked — these check the caching logic, not OpenAI.
+"""
+import base64
+from array import array
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app.services import embeddings
+from app.services.embeddings import embed_query, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  Rain   JACKET ") == "rain jacket"
+
+
+async def test_embed_query_reuses_cached_vector():
+    """Repeated (and trivially different) queries embed only once."""
+    with patch.object(
+        embeddings, "embed_vector", new_callable=AsyncMock, return_value=array("f", [0.5, 0.25]),
+    ) as mock_embed:
+        first = await embed_query("test cache warm sleeping bag")
+        second = await embed_query("Test Cache  warm sleeping bag")
+
+    mock_embed.assert_called_once_with("test cache warm sleeping bag")
+    assert first == second == [0.5, 0.25]
+
+
+async def test_embed_query_evicts_least_recently_used():
+    with (
+        patch.object(embeddings, "QUERY_CACHE_SIZE", 2),
+        patch.object(embeddings, "_query_cache", embeddings.OrderedDict()),
+        patch.object(embeddings, "embed_vector", new_callable=AsyncMock, return_value=array("f", [1.0])),
+    ):
+        await embed_query("a")
+        await embed_query("b")
+        await embed_query("a")  # refresh "a"
+        await embed_query("c")  # evicts "b"
+        assert list(embeddings._query_cache) == ["a", "c"]
+
+
+async def test_embed_vector_decodes_base64_float32():
+    raw = array("f", [0.5, -1.25, 3.0])
+    response = SimpleNamespace(data=[SimpleNamespace(embedding=base64.b64encode(raw.tobytes()).decode())])
+    with patch.object(
+        embeddings.client.embeddings, "create", new_callable=AsyncMock, return_value=response,
+    ) as mock_create:
+        vector = await embeddings.embed_vector("rain jacket")
+
+    assert mock_create.call_args.kwargs["encoding_format"] == "base64"
+    assert vector == raw
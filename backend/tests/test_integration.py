@@ -16,7 +16,13 @@ from app.agent.tools import (
     search_products,
 )
 from app.models import Message
-from app.services.conversation import save_message, load_messages
+from app.services.context_manager import WINDOW_STEP
+from app.services.conversation import (
+    load_messages,
+    load_recent_messages,
+    save_message,
+    save_messages,
+)
 
 
 def setup_context(db, user_id="test_user"):
@@ -112,6 +118,34 @@ async def test_save_and_load_messages(db):
     assert messages[2].content == "Add the first one to my cart"
 
 
+async def test_save_messages_batch_keeps_order(db):
+    """A turn saved in one INSERT loads back in input order (shared created_at)."""
+    convo_id = "integration-batch-convo"
+
+    ids = await save_messages(db, convo_id, [
+        ("user", "What's in my cart?"),
+        ("assistant", "Your cart is empty."),
+    ])
+    assert len(ids) == 2
+
+    messages = await load_messages(db, convo_id)
+    assert [m.id for m in messages] == ids
+    assert [m.role for m in messages] == ["user", "assistant"]
+
+
+async def test_load_recent_messages_aligned_tail(db):
+    """Only the newest messages load, starting on a WINDOW_STEP boundary."""
+    convo_id = "integration-recent-convo"
+    total = 3 * WINDOW_STEP + 3
+    await save_messages(db, convo_id, [("user", f"msg {i}") for i in range(total)])
+
+    recent = await load_recent_messages(db, convo_id, limit=WINDOW_STEP)
+
+    # total - limit = 2 * STEP + 3 → snapped down to 2 * STEP
+    assert [m.content for m in recent] == [f"msg {i}" for i in range(2 * WINDOW_STEP, total)]
+    assert await load_recent_messages(db, "integration-recent-empty") == []
+
+
 async def test_conversations_are_isolated(db):
     """Messages from different conversations don't leak."""
     await save_message(db, "convo-A", "user", "msg in A")
@@ -132,8 +166,8 @@ async def test_load_via_endpoint_after_save(client, db):
     This crosses the service → endpoint boundary.
     """
     convo_id = "endpoint-load-test"
-    await save_message(db, convo_id, "user", "Hello")
-    await save_message(db, convo_id, "assistant", "Hi there!")
+    # One INSERT, the way the chat endpoints save a turn
+    await save_messages(db, convo_id, [("user", "Hello"), ("assistant", "Hi there!")])
 
     response = await client.get(f"/api/chat/{convo_id}/messages")
     assert response.status_code == 200
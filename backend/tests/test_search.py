@@ -0,0 +1,74 @@
+"""
+Tests for semantic_search's SQL step and the search_products tool on top.
+
+Embedding and Pinecone are mocked — these check ordering and filters
+against the real database, the layers scripts/test_search.py checks live.
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app.agent.context import db_var
+from app.agent.tools import search_products
+from app.services import search
+from app.services.search import build_metadata_filter, semantic_search
+
+
+def _matches(*product_ids):
+    """Pinecone-style matches, best first."""
+    return [SimpleNamespace(id=str(pid)) for pid in product_ids]
+
+
+async def test_semantic_search_keeps_similarity_order(db, sample_products):
+    jacket, boots, bag = sample_products
+    with (
+        patch.object(search, "embed_query", new_callable=AsyncMock, return_value=[0.0]),
+        patch.object(search, "search_similar", new_callable=AsyncMock, return_value=_matches(bag.id, boots.id, jacket.id)),
+    ):
+        results = await semantic_search("gear", db, in_stock_only=False)
+
+    assert [p.id for p in results] == [bag.id, boots.id, jacket.id]
+
+
+async def test_semantic_search_filters_then_limits(db, sample_products):
+    jacket, boots, bag = sample_products
+    with (
+        patch.object(search, "embed_query", new_callable=AsyncMock, return_value=[0.0]),
+        patch.object(search, "search_similar", new_callable=AsyncMock, return_value=_matches(bag.id, boots.id, jacket.id)),
+    ):
+        results = await semantic_search("gear", db, top_k=1)
+
+    # The sleeping bag is out of stock, so the best in-stock match wins
+    assert [p.id for p in results] == [boots.id]
+
+
+async def test_search_products_tool_output(db, sample_products):
+    """The tool formats the in-stock matches for the agent, best first."""
+    jacket, boots, bag = sample_products
+    db_var.set(db)
+    with (
+        patch.object(search, "embed_query", new_callable=AsyncMock, return_value=[0.0]),
+        patch.object(search, "search_similar", new_callable=AsyncMock, return_value=_matches(boots.id, bag.id, jacket.id)),
+    ):
+        result = await search_products.ainvoke({"query": "hiking gear"})
+
+    assert result.index(boots.name) < result.index(jacket.name)
+    assert bag.name not in result  # out of stock
+
+
+async def test_search_products_tool_no_matches(db):
+    db_var.set(db)
+    with (
+        patch.object(search, "embed_query", new_callable=AsyncMock, return_value=[0.0]),
+        patch.object(search, "search_similar", new_callable=AsyncMock, return_value=[]),
+    ):
+        result = await search_products.ainvoke({"query": "spaceship"})
+
+    assert result == "No products found matching your search."
+
+
+def test_build_metadata_filter():
+    assert build_metadata_filter(None, None) is None
+    assert build_metadata_filter(50.0, " Jackets ") == {
+        "price": {"$lte": 50.0},
+        "category": {"$eq": "jackets"},
+    }
@@ -12,6 +12,7 @@ async def test_client_works(client):
     """Test that the HTTP client can hit endpoints."""
     response = await client.get("/api/health")
     assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
 
 
 async def test_fixtures_work(sample_products):
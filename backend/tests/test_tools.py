@@ -8,16 +8,25 @@ without going through the HTTP layer.
 Key pattern: set db_var and user_id_var before calling the tool,
 just like the chat endpoint does per-request.
 """
-from app.agent.context import db_var, user_id_var
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.agent.context import db_var, tool_cache_var, user_id_var
+from app.agent.graph import invoke_tool, invoke_tools
 from app.agent.tools import (
     add_to_cart,
     compare_products,
     get_current_cart,
     get_product_details,
+    prefetch_products,
     remove_from_cart,
     search_products,
 )
 from app.models import CartItem, Product
+from app.services import search
 
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
@@ -28,6 +37,12 @@ def setup_context(db, user_id="test_user"):
     user_id_var.set(user_id)
 
 
+def assert_contains_all(text: str, *needles: str):
+    """Assert every needle is in the tool output, reporting all that are missing."""
+    missing = [n for n in needles if n not in text]
+    assert not missing, f"missing {missing} in:\n{text}"
+
+
 # ── get_product_details ──────────────────────────────────────────────────────
 
 async def test_get_product_details(db, sample_products):
@@ -37,12 +52,6 @@ async def test_get_product_details(db, sample_products):
     assert "$74.99" in result
 
 
-async def test_get_product_details_not_found(db):
-    setup_context(db)
-    result = await get_product_details.ainvoke({"product_id": 99999})
-    assert "not found" in result
-
-
 # ── add_to_cart ──────────────────────────────────────────────────────────────
 
 async def test_add_to_cart(db, sample_products):
@@ -55,23 +64,14 @@ async def test_add_to_cart(db, sample_products):
     assert "$74.99" in result
 
 
-async def test_add_to_cart_upsert(db, sample_products):
-    """Adding same product twice increases quantity."""
+async def test_add_to_cart_upsert(db, sample_cart_item):
+    """Adding a product already in the cart increases quantity."""
     setup_context(db)
-    product_id = sample_products[0].id
-
-    await add_to_cart.ainvoke({"product_id": product_id, "quantity": 1})
-    await add_to_cart.ainvoke({"product_id": product_id, "quantity": 3})
+    await add_to_cart.ainvoke({"product_id": sample_cart_item.product_id, "quantity": 3})
 
-    # Verify quantity is 4 (1 + 3)
+    # Verify quantity is 5 (2 already in the cart + 3)
     cart_result = await get_current_cart.ainvoke({})
-    assert "x4" in cart_result
-
-
-async def test_add_to_cart_not_found(db):
-    setup_context(db)
-    result = await add_to_cart.ainvoke({"product_id": 99999})
-    assert "not found" in result
+    assert "x5" in cart_result
 
 
 # ── get_current_cart ─────────────────────────────────────────────────────────
@@ -82,28 +82,20 @@ async def test_get_cart_empty(db):
     assert "empty" in result.lower()
 
 
-async def test_get_cart_with_items(db, sample_products):
-    setup_context(db)
-    await add_to_cart.ainvoke({"product_id": sample_products[0].id, "quantity": 2})
+async def test_get_cart_with_items(db, sample_products, sample_cart_item):
+    setup_context(db)  # the cart already holds 2x the rain jacket
     await add_to_cart.ainvoke({"product_id": sample_products[1].id, "quantity": 1})
 
     result = await get_current_cart.ainvoke({})
-    assert "Test Rain Jacket" in result
-    assert "Test Hiking Boots" in result
-    assert "Total:" in result
     # 74.99 * 2 + 89.99 * 1 = 239.97
-    assert "$239.97" in result
+    assert_contains_all(result, "Test Rain Jacket", "Test Hiking Boots", "Total:", "$239.97")
 
 
 # ── remove_from_cart ─────────────────────────────────────────────────────────
 
-async def test_remove_from_cart(db, sample_products):
+async def test_remove_from_cart(db, sample_cart_item):
     setup_context(db)
-    product_id = sample_products[0].id
-
-    # Add then remove
-    await add_to_cart.ainvoke({"product_id": product_id})
-    result = await remove_from_cart.ainvoke({"product_id": product_id})
+    result = await remove_from_cart.ainvoke({"product_id": sample_cart_item.product_id})
     assert "Removed" in result
 
     # Cart should be empty now
@@ -111,10 +103,21 @@ async def test_remove_from_cart(db, sample_products):
     assert "empty" in cart.lower()
 
 
-async def test_remove_from_cart_not_in_cart(db):
+# ── Unknown product IDs ──────────────────────────────────────────────────────
+
+# Shared by every case below — ainvoke only reads its input
+UNKNOWN_PRODUCT_ARGS = {"product_id": 99999}
+
+
+@pytest.mark.parametrize(("tool", "expected"), [
+    (get_product_details, "not found"),
+    (add_to_cart, "not found"),
+    (remove_from_cart, "not in your cart"),
+])
+async def test_unknown_product_id(db, tool, expected):
     setup_context(db)
-    result = await remove_from_cart.ainvoke({"product_id": 99999})
-    assert "not in your cart" in result
+    result = await tool.ainvoke(UNKNOWN_PRODUCT_ARGS)
+    assert expected in result
 
 
 # ── compare_products ─────────────────────────────────────────────────────────
@@ -123,12 +126,121 @@ async def test_compare_products(db, sample_products):
     setup_context(db)
     ids = [sample_products[0].id, sample_products[1].id]
     result = await compare_products.ainvoke({"product_ids": ids})
-    assert "Test Rain Jacket" in result
-    assert "Test Hiking Boots" in result
-    assert "vs" in result
+    assert_contains_all(result, "Test Rain Jacket", "Test Hiking Boots", "vs")
 
 
 async def test_compare_products_need_two(db, sample_products):
     setup_context(db)
     result = await compare_products.ainvoke({"product_ids": [sample_products[0].id]})
     assert "at least 2" in result
+
+
+# ── invoke_tool (per-turn cache) ─────────────────────────────────────────────
+
+async def test_invoke_tool_caches_catalog_reads(db, sample_products):
+    setup_context(db)
+    cache = {}
+    tool_cache_var.set(cache)
+    call = {"name": "get_product_details", "args": {"product_id": sample_products[0].id}}
+
+    first = await invoke_tool(call)
+    second = await invoke_tool(call)
+    assert first == second
+    assert len(cache) == 1
+
+
+async def test_invoke_tool_skips_cache_for_cart_tools(db, sample_products):
+    setup_context(db)
+    cache = {}
+    tool_cache_var.set(cache)
+
+    await invoke_tool({"name": "add_to_cart", "args": {"product_id": sample_products[0].id}})
+    cart = await invoke_tool({"name": "get_current_cart", "args": {}})
+    assert "x1" in cart
+    assert cache == {}
+
+
+async def test_invoke_tools_runs_cart_calls_in_order(db, sample_products):
+    """Cart calls in one round run sequentially, so later calls see earlier writes."""
+    setup_context(db)
+    tool_cache_var.set({})
+    results = await invoke_tools([
+        {"name": "add_to_cart", "args": {"product_id": sample_products[0].id, "quantity": 2}},
+        {"name": "get_current_cart", "args": {}},
+    ])
+    assert "Added 2x Test Rain Jacket" in results[0]
+    assert "x2" in results[1]
+
+
+async def test_invoke_tools_returns_exceptions(db):
+    setup_context(db)
+    tool_cache_var.set({})
+    results = await invoke_tools(
+        [{"name": "add_to_cart", "args": {"product_id": "not-an-int"}}],
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], Exception)
+
+
+async def test_invoke_tools_batches_product_details(db, sample_products):
+    """Several get_product_details calls are answered from one query, in order."""
+    setup_context(db)
+    cache: dict = {}
+    tool_cache_var.set(cache)
+    results = await invoke_tools([
+        {"name": "get_product_details", "args": {"product_id": sample_products[1].id}},
+        {"name": "get_product_details", "args": {"product_id": 999999}},
+        {"name": "get_product_details", "args": {"product_id": sample_products[0].id}},
+    ])
+    assert sample_products[1].name in results[0]
+    assert results[1] == "Product with ID 999999 not found."
+    assert sample_products[0].name in results[2]
+    assert len(cache) == 3
+
+
+async def test_invoke_tools_batch_fails_bad_calls_alone(db, sample_products):
+    """A malformed call in the batch gets its own error; its siblings still answer."""
+    setup_context(db)
+    tool_cache_var.set({})
+    results = await invoke_tools([
+        {"name": "get_product_details", "args": {"product_id": sample_products[0].id}},
+        {"name": "get_product_details", "args": {}},
+    ], return_exceptions=True)
+    assert sample_products[0].name in results[0]
+    assert isinstance(results[1], Exception)
+
+
+async def test_invoke_tools_batch_skips_cached_ids(db, sample_products):
+    """Products already fetched this turn aren't queried again."""
+    setup_context(db)
+    jacket, boots, _ = sample_products
+    tool_cache_var.set({
+        ("get_product_details", json.dumps({"product_id": jacket.id})): "cached jacket",
+    })
+    with patch("app.agent.graph.prefetch_products", wraps=prefetch_products) as prefetch:
+        results = await invoke_tools([
+            {"name": "get_product_details", "args": {"product_id": jacket.id}},
+            {"name": "get_product_details", "args": {"product_id": boots.id}},
+        ])
+    prefetch.assert_awaited_once_with([boots.id])
+    assert results[0] == "cached jacket"
+    assert boots.name in results[1]
+
+
+async def test_invoke_tools_concurrent_reads_see_request_transaction(db, sample_products):
+    """Reads in one round all see the request session's uncommitted rows."""
+    setup_context(db)
+    tool_cache_var.set({})
+    jacket, boots, _ = sample_products
+    with (
+        patch.object(search, "embed_query", new_callable=AsyncMock, return_value=[0.0]),
+        patch.object(search, "search_similar", new_callable=AsyncMock, return_value=[SimpleNamespace(id=str(jacket.id))]),
+    ):
+        results = await invoke_tools([
+            {"name": "search_products", "args": {"query": "jacket"}},
+            {"name": "get_product_details", "args": {"product_id": jacket.id}},
+            {"name": "get_product_details", "args": {"product_id": boots.id}},
+        ])
+    assert jacket.name in results[0]
+    assert jacket.name in results[1]
+    assert boots.name in results[2]